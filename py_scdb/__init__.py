@@ -1,6 +1,8 @@
-from py_scdb.py_scdb import Store, AsyncStore
+from py_scdb.py_scdb import Store, AsyncStore, Pipeline, verify
 
 __all__ = [
     Store,
     AsyncStore,
+    Pipeline,
+    verify,
 ]
@@ -1,4 +1,4 @@
-from typing import Optional, List, Tuple
+from typing import Any, Optional, List, Tuple, Dict, Callable, Iterator
 
 class Store:
     """
@@ -8,6 +8,9 @@ class Store:
     on disk. It allows for specifying how long each key-value pair should be
     kept for i.e. the time-to-live in seconds. If None is provided, they last indefinitely.
 
+    The store can be shared among threads. The GIL is released while it works on the database file,
+    so other python threads keep running, but only one thread at a time can access the file.
+
     :param store_path: The path to a directory where scdb should store its data
     :param max_keys: The maximum number of key-value pairs to store in store; default: 1 million
     :param redundant_blocks: The store has an index to hold all the keys. This index is split
@@ -38,6 +41,34 @@ class Store:
                               Note that when search is enabled, `set`, `delete`, `clear`, `compact`
                               operations become slower.
                               Default: False
+    :param bloom_filter_fp_rate: The false-positive rate of an in-memory bloom filter kept in front of the index.
+                                If set, `get`, `contains`, `contains_many` and `delete` for keys that were never set
+                                return without touching the database file. The filter is sized for `max_keys`
+                                and persisted to `bloom.scdb` next to `dump.scdb` on `flush`, on `compact` and when
+                                the store is closed. It is only trusted if the store was empty when the filter was
+                                created, or it was persisted after the last change made the last time the store was
+                                opened with a filter; otherwise, it is bypassed until `clear` is called or, if
+                                `is_search_enabled`, until `compact` rebuilds it from the keys in the store.
+                                Only enable it if this is the only process writing to the store.
+                                Default: None (disabled)
+    :param blob_threshold: The size in bytes from which values are stored out of line, in segment files in the
+                          `blobs` folder next to `dump.scdb`. The database file then holds only a small pointer
+                          to each of them. This keeps large values from evicting the index and small values
+                          from the buffers in the pool, and keeps `compact` from rewriting large values.
+                          Space held by dead large values is reclaimed only when `compact` is called manually.
+                          Large values stored earlier can still be read when this is None.
+                          Each large value is stored with a checksum. Records torn by a crash are dropped
+                          when the store is opened, and reading a corrupted large value raises an IOError.
+                          Several stores, in this or other processes, can store large values under the same
+                          `store_path` at once, but `compact` must only be called while no other store is
+                          writing to it.
+                          Default: None (all values are stored in the database file)
+    :param codec: How values are converted by `store[k]` and `store[k] = v`. Either "str", where values must be
+                 strings as in `get` and `set`, or "json", where values can be dicts (with string keys), lists,
+                 tuples, strings, ints, floats, booleans and None, converted to and from JSON in rust.
+                 Tuples come back as lists. Lists and dicts can be nested up to 127 levels deep.
+                 `get`, `set` and `search` always work with the raw strings.
+                 Default: None ("str")
     """
 
     def __init__(
@@ -48,6 +79,9 @@ class Store:
         pool_capacity: Optional[int] = None,
         compaction_interval: Optional[int] = None,
         is_search_enabled: bool = False,
+        bloom_filter_fp_rate: Optional[float] = None,
+        blob_threshold: Optional[int] = None,
+        codec: Optional[str] = None,
     ) -> None: ...
     def set(self, k: str, v: str, ttl: Optional[int] = None) -> None:
         """
@@ -64,6 +98,33 @@ class Store:
         :param k: the key as a UTF-8 string
         :return: the value if it exists or None if it doesn't
         """
+    def contains(self, k: str) -> bool:
+        """
+        Checks whether the given key exists in the store
+
+        This is cheaper than `get` as the value is never decoded into a python string.
+
+        :param k: the key as a UTF-8 string
+        :return: True if the key exists and has not expired, else False
+        """
+    def contains_many(self, keys: List[str]) -> List[bool]:
+        """
+        Checks whether each of the given keys exists in the store
+
+        :param keys: the keys as UTF-8 strings
+        :return: a list of booleans, one for each key in the order the keys were given
+        """
+    def count(self, prefix: str) -> int:
+        """
+        Counts the key-values whose keys start with the substring `prefix`.
+
+        This is cheaper than `len(store.search(prefix))` as no python strings are created
+        for the matched key-value pairs.
+        It requires the store to be search-enabled.
+
+        :param prefix: the starting substring to check all keys against
+        :return: the number of key-value pairs whose key starts with the `prefix`
+        """
     def search(self, term: str, skip: int = 0, limit: int = 0) -> List[Tuple[str, str]]:
         """
         Finds all key-values whose keys start with the substring `term`.
@@ -106,8 +167,107 @@ class Store:
         This is done automatically for you at the set `compaction_interval` but you
         may wish to do it manually for some reason.
 
+        If `blob_threshold` is set, this also deletes the segment files whose large values
+        are all dead, after moving the few live ones out of segments that are mostly dead.
+        Segments that are mostly live are left as they are, so calling this often does not
+        add segment files.
+
+        If `bloom_filter_fp_rate` is set, the bloom filter is then persisted. If `is_search_enabled`,
+        it is first rebuilt from the keys in the store, dropping deleted and expired keys.
+        Without search, scdb cannot list the keys, so the filter is not rebuilt.
+
         This is a very expensive operation so use it sparingly.
         """
+    def flush(self) -> None:
+        """
+        Persists the bloom filter, if `bloom_filter_fp_rate` is set, so that it is trusted on the next start
+        even if the process is killed before the store is closed.
+        Keys set after this are not in the persisted filter, so it is not trusted if the process is killed
+        before the next `flush`, `compact` or close.
+        """
+    def __getitem__(self, k: str) -> Any:
+        """
+        Returns the value for the given key, decoded with the store's `codec`
+
+        :param k: the key as a UTF-8 string
+        :return: the decoded value
+        :raises KeyError: if the key is not in the store
+        """
+    def __setitem__(self, k: str, v: Any) -> None:
+        """
+        Inserts or updates the key-value pair, with the value encoded with the store's `codec`.
+        The key-value pair is persisted indefinitely.
+
+        :param k: the key as a UTF-8 string
+        :param v: the value, of a type supported by the store's `codec`
+        :raises TypeError: if the value cannot be encoded by the store's `codec`
+        :raises ValueError: if the value is nested too deeply, contains itself, or is a NaN or infinite float,
+                            for the "json" codec
+        """
+    def __delitem__(self, k: str) -> None:
+        """
+        Removes the key-value for the given key from the store
+
+        :param k: the key as a UTF-8 string
+        :raises KeyError: if the key is not in the store
+        """
+    def __contains__(self, k: str) -> bool:
+        """
+        Checks whether the given key is in the store, like `contains`
+
+        :param k: the key as a UTF-8 string
+        :return: True if the key is in the store
+        """
+    def __len__(self) -> int:
+        """
+        Returns the number of keys in the store, by listing them all
+
+        :return: the number of keys
+        :raises TypeError: if the store was not opened with `is_search_enabled=True`
+        """
+    def __iter__(self) -> Iterator[str]:
+        """
+        Returns an iterator over the keys in the store when it is called.
+        Keys set or deleted afterwards are not reflected.
+
+        :return: an iterator over the keys as UTF-8 strings
+        :raises TypeError: if the store was not opened with `is_search_enabled=True`
+        """
+    def set_trace_callback(
+        self,
+        callback: Optional[Callable[[str, Dict[str, float]], None]],
+        sample_rate: float = 1.0,
+    ) -> None:
+        """
+        Sets a callback to profile a sample of the store's operations.
+
+        For every sampled operation, `callback` is called with the name of the operation e.g. "get",
+        and a dict of the seconds spent in each of its phases. The phases are:
+
+        - "schedule": waiting for the operation to start running (AsyncStore only)
+        - "lock": waiting for other threads or tasks using the store to finish
+        - "filter": checking or updating the bloom filter
+        - "db": the scdb operation itself i.e. index probing, buffer pool lookups and disk access,
+          including reading and writing large values stored out of line
+        - "encode": converting the value into bytes with the store's `codec`
+        - "decode": converting the raw bytes into python objects
+        - "total": the whole operation
+
+        Exceptions raised in `callback` are printed and ignored.
+        When no callback is set, the overhead of tracing is taking a shared lock once per operation.
+        The callback can be set, replaced or removed at any time, even while other threads are using the store.
+        Operations that already started keep the callback they started with.
+
+        :param callback: the function to call with the timings of each sampled operation. None disables tracing
+        :param sample_rate: the fraction of operations to trace, greater than 0 and not more than 1. Default: 1.0
+        """
+    def bloom_filter_stats(self) -> Optional[Dict[str, int]]:
+        """
+        Returns the number of `lookups` made against the bloom filter since the store was opened
+        and how many of them were `short_circuits` i.e. answered without touching the database file.
+
+        :return: a dict with keys "lookups" and "short_circuits" or None if the bloom filter is disabled
+        """
 
 class AsyncStore:
     """
@@ -148,6 +308,28 @@ class AsyncStore:
                               Note that when search is enabled, `set`, `delete`, `clear`, `compact`
                               operations become slower.
                               Default: False
+    :param bloom_filter_fp_rate: The false-positive rate of an in-memory bloom filter kept in front of the index.
+                                If set, `get`, `contains`, `contains_many` and `delete` for keys that were never set
+                                return without touching the database file. The filter is sized for `max_keys`
+                                and persisted to `bloom.scdb` next to `dump.scdb` on `flush`, on `compact` and when
+                                the store is closed. It is only trusted if the store was empty when the filter was
+                                created, or it was persisted after the last change made the last time the store was
+                                opened with a filter; otherwise, it is bypassed until `clear` is called or, if
+                                `is_search_enabled`, until `compact` rebuilds it from the keys in the store.
+                                Only enable it if this is the only process writing to the store.
+                                Default: None (disabled)
+    :param blob_threshold: The size in bytes from which values are stored out of line, in segment files in the
+                          `blobs` folder next to `dump.scdb`. The database file then holds only a small pointer
+                          to each of them. This keeps large values from evicting the index and small values
+                          from the buffers in the pool, and keeps `compact` from rewriting large values.
+                          Space held by dead large values is reclaimed only when `compact` is called manually.
+                          Large values stored earlier can still be read when this is None.
+                          Each large value is stored with a checksum. Records torn by a crash are dropped
+                          when the store is opened, and reading a corrupted large value raises an IOError.
+                          Several stores, in this or other processes, can store large values under the same
+                          `store_path` at once, but `compact` must only be called while no other store is
+                          writing to it.
+                          Default: None (all values are stored in the database file)
     """
 
     def __init__(
@@ -158,6 +340,8 @@ class AsyncStore:
         pool_capacity: Optional[int] = None,
         compaction_interval: Optional[int] = None,
         is_search_enabled: bool = False,
+        bloom_filter_fp_rate: Optional[float] = None,
+        blob_threshold: Optional[int] = None,
     ) -> None: ...
     async def set(self, k: str, v: str, ttl: Optional[int] = None) -> None:
         """
@@ -174,6 +358,33 @@ class AsyncStore:
         :param k: the key as a UTF-8 string
         :return: the value if it exists or None if it doesn't
         """
+    async def contains(self, k: str) -> bool:
+        """
+        Checks whether the given key exists in the store
+
+        This is cheaper than `get` as the value is never decoded into a python string.
+
+        :param k: the key as a UTF-8 string
+        :return: True if the key exists and has not expired, else False
+        """
+    async def contains_many(self, keys: List[str]) -> List[bool]:
+        """
+        Checks whether each of the given keys exists in the store
+
+        :param keys: the keys as UTF-8 strings
+        :return: a list of booleans, one for each key in the order the keys were given
+        """
+    async def count(self, prefix: str) -> int:
+        """
+        Counts the key-values whose keys start with the substring `prefix`.
+
+        This is cheaper than `len(store.search(prefix))` as no python strings are created
+        for the matched key-value pairs.
+        It requires the store to be search-enabled.
+
+        :param prefix: the starting substring to check all keys against
+        :return: the number of key-value pairs whose key starts with the `prefix`
+        """
     async def search(
         self, term: str, skip: int = 0, limit: int = 0
     ) -> List[Tuple[str, str]]:
@@ -218,5 +429,139 @@ class AsyncStore:
         This is done automatically for you at the set `compaction_interval` but you
         may wish to do it manually for some reason.
 
+        If `blob_threshold` is set, this also deletes the segment files whose large values
+        are all dead, after moving the few live ones out of segments that are mostly dead.
+        Segments that are mostly live are left as they are, so calling this often does not
+        add segment files.
+
+        If `bloom_filter_fp_rate` is set, the bloom filter is then persisted. If `is_search_enabled`,
+        it is first rebuilt from the keys in the store, dropping deleted and expired keys.
+        Without search, scdb cannot list the keys, so the filter is not rebuilt.
+
         This is a very expensive operation so use it sparingly.
         """
+    async def flush(self) -> None:
+        """
+        Persists the bloom filter, if `bloom_filter_fp_rate` is set, so that it is trusted on the next start
+        even if the process is killed before the store is closed.
+        Keys set after this are not in the persisted filter, so it is not trusted if the process is killed
+        before the next `flush`, `compact` or close.
+        """
+    def pipeline(self) -> "Pipeline":
+        """
+        Creates a pipeline on which many `set`, `get` and `delete` operations can be queued,
+        to be run in order, under a single lock on the store, when the pipeline is executed.
+
+        This is much cheaper than awaiting each operation on its own, or in an `asyncio.gather`
+        since only one future and one task are created for all the operations.
+
+        :return: an empty pipeline for this store
+        """
+    def set_trace_callback(
+        self,
+        callback: Optional[Callable[[str, Dict[str, float]], None]],
+        sample_rate: float = 1.0,
+    ) -> None:
+        """
+        Sets a callback to profile a sample of the store's operations.
+
+        For every sampled operation, `callback` is called with the name of the operation e.g. "get",
+        and a dict of the seconds spent in each of its phases. The phases are:
+
+        - "schedule": waiting for the operation to start running (AsyncStore only)
+        - "lock": waiting for other threads or tasks using the store to finish
+        - "filter": checking or updating the bloom filter
+        - "db": the scdb operation itself i.e. index probing, buffer pool lookups and disk access,
+          including reading and writing large values stored out of line
+        - "decode": converting the raw bytes into python strings
+        - "total": the whole operation
+
+        Exceptions raised in `callback` are printed and ignored.
+        When no callback is set, the overhead of tracing is taking a shared lock once per operation.
+        The callback can be set, replaced or removed at any time, even while other threads are using the store.
+        Operations that already started keep the callback they started with.
+
+        :param callback: the function to call with the timings of each sampled operation. None disables tracing
+        :param sample_rate: the fraction of operations to trace, greater than 0 and not more than 1. Default: 1.0
+        """
+    def bloom_filter_stats(self) -> Optional[Dict[str, int]]:
+        """
+        Returns the number of `lookups` made against the bloom filter since the store was opened
+        and how many of them were `short_circuits` i.e. answered without touching the database file.
+
+        :return: a dict with keys "lookups" and "short_circuits" or None if the bloom filter is disabled
+        """
+
+class Pipeline:
+    """
+    A queue of operations to run on an `AsyncStore` in one go.
+
+    It is created by `AsyncStore.pipeline()`. Its `set`, `get` and `delete` methods
+    return the pipeline itself so that they can be chained.
+
+    ```python
+    results = await store.pipeline().set("foo", "bar").get("foo").delete("baz").execute()
+    # results == [None, "bar", None]
+    ```
+    """
+
+    def set(self, k: str, v: str, ttl: Optional[int] = None) -> "Pipeline":
+        """
+        Queues the insertion or update of the key-value pair
+
+        :param k: the key as a UTF-8 string
+        :param v: the value as a UTF-8 string
+        :param ttl: the number of seconds the key-value pair should be persisted for
+        :return: the pipeline
+        """
+    def get(self, k: str) -> "Pipeline":
+        """
+        Queues the getting of the value associated with the given key
+
+        :param k: the key as a UTF-8 string
+        :return: the pipeline
+        """
+    def delete(self, k: str) -> "Pipeline":
+        """
+        Queues the removal of the key-value for the given key
+
+        :param k: the key as a UTF-8 string
+        :return: the pipeline
+        """
+    def __len__(self) -> int:
+        """
+        Returns the number of queued operations
+        """
+    async def execute(self) -> List[Optional[str]]:
+        """
+        Runs all queued operations in the order they were queued, under a single lock on the store.
+
+        The queue is emptied so the pipeline can be reused.
+        If an operation fails, the error is raised and the operations after it are not run.
+        The operations before it are not undone.
+
+        :return: a list with the result of each operation, in order: the value for `get`,
+                 or None if the key doesn't exist, and None for `set` and `delete`
+        """
+
+def verify(store_path: str, repair: bool = False) -> List[str]:
+    """
+    Checks the files that py_scdb keeps next to `dump.scdb` i.e. the bloom filter (`bloom.scdb`)
+    and the segment files of large values (`blobs/*.blob`), against their checksums.
+    The segment files are checked in parallel, on as many threads as there are CPUs.
+
+    Repairing fails with an IOError while a store is open on `store_path`.
+    `dump.scdb` itself is not checked; it is owned, and recovered when opened, by scdb.
+
+    Opening a store already drops the torn records at the end of the newest segment file,
+    and ignores a corrupted bloom filter, so this is only needed to find or drop corrupted
+    data elsewhere e.g. after a disk error.
+
+    :param store_path: The path to the directory where the store saves its data
+    :param repair: Whether to fix the problems found, by removing a corrupted bloom filter,
+                  truncating the torn or corrupted records at the end of each segment file
+                  and overwriting the other corrupted records, leaving the intact ones in place.
+                  The keys of the dropped large values read as absent, and are deleted
+                  when first read; until then `contains` may still report them. Default: False
+    :return: a description of each problem found, or an empty list if there were none
+    """
@@ -1,10 +1,23 @@
-use crate::macros::{acquire_lock, bytes_to_string, io_to_py_result, py_none};
+use crate::blob::{self, BlobStore};
+use crate::bloom::{self, BloomFilter};
+use crate::lock::StoreLock;
+use crate::macros::{acquire_lock, bytes_to_string, io_to_py_result, py_none, trace_phase};
+use crate::pipeline::Pipeline;
+use crate::trace::{start_span, SharedTracer};
 use pyo3::prelude::*;
-use std::sync::{Arc, Mutex};
+use std::collections::HashMap;
+use std::sync::{Arc, Mutex, MutexGuard};
 
 #[pyclass(subclass)]
 pub(crate) struct AsyncStore {
     db: Arc<Mutex<scdb::Store>>,
+    filter: Option<Arc<Mutex<BloomFilter>>>,
+    /// The counts of lookups of the bloom filter, read without waiting on `filter`
+    filter_stats: Option<Arc<bloom::Stats>>,
+    blobs: Option<Arc<Mutex<BlobStore>>>,
+    tracer: SharedTracer,
+    /// Keeps `verify` from repairing the files while the store is open
+    _lock: StoreLock,
 }
 
 #[pymethods]
@@ -16,7 +29,9 @@ impl AsyncStore {
         redundant_blocks = "None",
         pool_capacity = "None",
         compaction_interval = "None",
-        is_search_enabled = "false"
+        is_search_enabled = "false",
+        bloom_filter_fp_rate = "None",
+        blob_threshold = "None"
     )]
     #[new]
     pub fn new(
@@ -26,7 +41,24 @@ impl AsyncStore {
         pool_capacity: Option<usize>,
         compaction_interval: Option<u32>,
         is_search_enabled: bool,
+        bloom_filter_fp_rate: Option<f64>,
+        blob_threshold: Option<usize>,
     ) -> PyResult<Self> {
+        let lock = io_to_py_result!(StoreLock::shared(store_path))?;
+        let filter = match bloom_filter_fp_rate {
+            None => {
+                io_to_py_result!(BloomFilter::invalidate(store_path))?;
+                None
+            }
+            Some(rate) => Some(io_to_py_result!(BloomFilter::open(
+                store_path,
+                max_keys,
+                rate,
+                is_search_enabled
+            ))?),
+        };
+        let blobs = io_to_py_result!(BlobStore::open(store_path, blob_threshold))?
+            .map(|blobs| Arc::new(Mutex::new(blobs)));
         let db = io_to_py_result!(scdb::Store::new(
             store_path,
             max_keys,
@@ -37,6 +69,11 @@ impl AsyncStore {
         ))?;
         Ok(Self {
             db: Arc::new(Mutex::new(db)),
+            filter_stats: filter.as_ref().map(BloomFilter::stats),
+            filter: filter.map(|filter| Arc::new(Mutex::new(filter))),
+            blobs,
+            tracer: SharedTracer::default(),
+            _lock: lock,
         })
     }
 
@@ -44,7 +81,7 @@ impl AsyncStore {
     ///
     /// This is used to insert or update any key-value pair in the store
     pub fn set<'a>(
-        &mut self,
+        &self,
         py: Python<'a>,
         k: String,
         v: String,
@@ -52,37 +89,144 @@ impl AsyncStore {
     ) -> PyResult<&'a PyAny> {
         let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
         let db = self.db.clone();
+        let blobs = self.blobs.clone();
+        let mut span = start_span(&self.tracer, "set");
+        let filter = self.filter.clone();
 
         pyo3_asyncio::async_std::future_into_py_with_locals(
             py,
             locals.clone(),
             pyo3_asyncio::async_std::scope(locals, async move {
+                trace_phase!(span, "schedule");
                 let mut db = acquire_lock!(db)?;
-                io_to_py_result!(db.set(k.as_bytes(), v.as_bytes(), ttl))?;
+                trace_phase!(span, "lock");
+                if let Some(filter) = filter {
+                    io_to_py_result!(acquire_lock!(filter)?.insert(k.as_bytes()))?;
+                }
+                trace_phase!(span, "filter");
+                let mut blobs = lock_blobs(&blobs)?;
+                io_to_py_result!(blob::set(
+                    &mut db,
+                    blobs.as_deref_mut(),
+                    k.as_bytes(),
+                    v.as_bytes(),
+                    ttl
+                ))?;
+                trace_phase!(span, "db");
                 Ok::<Py<PyAny>, PyErr>(py_none!())
             }),
         )
     }
 
     /// Returns the value corresponding to the given key
-    pub fn get<'a>(&mut self, py: Python<'a>, k: String) -> PyResult<&'a PyAny> {
+    pub fn get<'a>(&self, py: Python<'a>, k: String) -> PyResult<&'a PyAny> {
         let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
         let db = self.db.clone();
+        let blobs = self.blobs.clone();
+        let mut span = start_span(&self.tracer, "get");
+        let filter = self.filter.clone();
 
         pyo3_asyncio::async_std::future_into_py_with_locals(
             py,
             locals.clone(),
             pyo3_asyncio::async_std::scope(locals, async move {
+                trace_phase!(span, "schedule");
+                let maybe_present = may_contain(&filter, k.as_bytes())?;
+                trace_phase!(span, "filter");
+                if !maybe_present {
+                    return Ok(py_none!());
+                }
                 let mut db = acquire_lock!(db)?;
-                let value = io_to_py_result!(db.get(k.as_bytes()))?;
+                trace_phase!(span, "lock");
+                let mut blobs = lock_blobs(&blobs)?;
+                let value = io_to_py_result!(blob::get(&mut db, blobs.as_deref_mut(), k.as_bytes()))?;
+                trace_phase!(span, "db");
 
-                match value {
-                    None => Ok(py_none!()),
+                let value = match value {
+                    None => py_none!(),
                     Some(v) => {
                         let v = bytes_to_string!(v)?;
-                        Ok(Python::with_gil(|py| v.into_py(py)))
+                        Python::with_gil(|py| v.into_py(py))
                     }
+                };
+                trace_phase!(span, "decode");
+                Ok(value)
+            }),
+        )
+    }
+
+    /// Checks whether the given key exists in the store without decoding its value
+    pub fn contains<'a>(&self, py: Python<'a>, k: String) -> PyResult<&'a PyAny> {
+        let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
+        let db = self.db.clone();
+        let mut span = start_span(&self.tracer, "contains");
+        let filter = self.filter.clone();
+
+        pyo3_asyncio::async_std::future_into_py_with_locals(
+            py,
+            locals.clone(),
+            pyo3_asyncio::async_std::scope(locals, async move {
+                trace_phase!(span, "schedule");
+                let maybe_present = may_contain(&filter, k.as_bytes())?;
+                trace_phase!(span, "filter");
+                if !maybe_present {
+                    return Ok(false);
                 }
+                let mut db = acquire_lock!(db)?;
+                trace_phase!(span, "lock");
+                let value = io_to_py_result!(db.get(k.as_bytes()))?;
+                trace_phase!(span, "db");
+                Ok::<bool, PyErr>(value.is_some())
+            }),
+        )
+    }
+
+    /// Checks whether each of the given keys exists in the store, in the order given
+    pub fn contains_many<'a>(&self, py: Python<'a>, keys: Vec<String>) -> PyResult<&'a PyAny> {
+        let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
+        let db = self.db.clone();
+        let mut span = start_span(&self.tracer, "contains_many");
+        let filter = self.filter.clone();
+
+        pyo3_asyncio::async_std::future_into_py_with_locals(
+            py,
+            locals.clone(),
+            pyo3_asyncio::async_std::scope(locals, async move {
+                trace_phase!(span, "schedule");
+                let mut db = acquire_lock!(db)?;
+                trace_phase!(span, "lock");
+                keys.into_iter().map(|k| {
+                    let maybe_present = may_contain(&filter, k.as_bytes())?;
+                    trace_phase!(span, "filter");
+                    if !maybe_present {
+                        return Ok(false);
+                    }
+                    let value = io_to_py_result!(db.get(k.as_bytes()))?;
+                    trace_phase!(span, "db");
+                    Ok::<bool, PyErr>(value.is_some())
+                }).collect::<PyResult<Vec<bool>>>()
+            }),
+        )
+    }
+
+    /// Counts the key-values whose key start with the given `prefix`
+    /// without converting them into python strings
+    pub fn count<'a>(&self, py: Python<'a>, prefix: &str) -> PyResult<&'a PyAny> {
+        let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
+        let db = self.db.clone();
+        let mut span = start_span(&self.tracer, "count");
+        let prefix = prefix.to_owned();
+
+        pyo3_asyncio::async_std::future_into_py_with_locals(
+            py,
+            locals.clone(),
+            pyo3_asyncio::async_std::scope(locals, async move {
+                trace_phase!(span, "schedule");
+                let mut db = acquire_lock!(db)?;
+                trace_phase!(span, "lock");
+                let res = io_to_py_result!(db.search(prefix.as_bytes(), 0, 0))?;
+                trace_phase!(span, "db");
+                Ok::<usize, PyErr>(res.len())
             }),
         )
     }
@@ -91,72 +235,175 @@ impl AsyncStore {
     ///
     /// In order to do pagination, we use `skip` to skip the first `skip` records
     /// and `limit` to return not more than the given number of items
-    pub fn search<'a>(&mut self, py: Python<'a>, term: &str, skip: u64, limit: u64) -> PyResult<&'a PyAny>  {
+    pub fn search<'a>(&self, py: Python<'a>, term: &str, skip: u64, limit: u64) -> PyResult<&'a PyAny>  {
         let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
         let db = self.db.clone();
+        let blobs = self.blobs.clone();
+        let mut span = start_span(&self.tracer, "search");
         let term = term.to_owned();
 
         pyo3_asyncio::async_std::future_into_py_with_locals(
             py,
             locals.clone(),
             pyo3_asyncio::async_std::scope(locals, async move {
+                trace_phase!(span, "schedule");
                 let mut db = acquire_lock!(db)?;
-                let res = db.search(term.as_bytes(), skip, limit);
+                trace_phase!(span, "lock");
+                let mut blobs = lock_blobs(&blobs)?;
+                let res = blob::search(&mut db, blobs.as_deref_mut(), term.as_bytes(), skip, limit);
                 let res: Vec<(Vec<u8>, Vec<u8>)> = io_to_py_result!(res)?;
-                res.into_iter().map(|(k, v)| {
+                trace_phase!(span, "db");
+                let res = res.into_iter().map(|(k, v)| {
                     let k = bytes_to_string!(k)?;
                     let v = bytes_to_string!(v)?;
                     Ok((k, v))
-                }).collect::<PyResult<Vec<(String, String)>>>()
+                }).collect::<PyResult<Vec<(String, String)>>>();
+                trace_phase!(span, "decode");
+                res
             }),
         )
     }
 
     /// Deletes the key-value for the given key
-    pub fn delete<'a>(&mut self, py: Python<'a>, k: String) -> PyResult<&'a PyAny> {
+    pub fn delete<'a>(&self, py: Python<'a>, k: String) -> PyResult<&'a PyAny> {
         let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
         let db = self.db.clone();
+        let mut span = start_span(&self.tracer, "delete");
+        let filter = self.filter.clone();
 
         pyo3_asyncio::async_std::future_into_py_with_locals(
             py,
             locals.clone(),
             pyo3_asyncio::async_std::scope(locals, async move {
+                trace_phase!(span, "schedule");
+                let maybe_present = may_contain(&filter, k.as_bytes())?;
+                trace_phase!(span, "filter");
+                if !maybe_present {
+                    return Ok(py_none!());
+                }
                 let mut db = acquire_lock!(db)?;
+                trace_phase!(span, "lock");
                 io_to_py_result!(db.delete(k.as_bytes()))?;
+                trace_phase!(span, "db");
                 Ok::<Py<PyAny>, PyErr>(py_none!())
             }),
         )
     }
 
     /// Clears all data in the store
-    pub fn clear<'a>(&mut self, py: Python<'a>) -> PyResult<&'a PyAny> {
+    pub fn clear<'a>(&self, py: Python<'a>) -> PyResult<&'a PyAny> {
         let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
         let db = self.db.clone();
+        let blobs = self.blobs.clone();
+        let mut span = start_span(&self.tracer, "clear");
+        let filter = self.filter.clone();
 
         pyo3_asyncio::async_std::future_into_py_with_locals(
             py,
             locals.clone(),
             pyo3_asyncio::async_std::scope(locals, async move {
+                trace_phase!(span, "schedule");
                 let mut db = acquire_lock!(db)?;
-                io_to_py_result!(db.clear())?;
+                trace_phase!(span, "lock");
+                let mut blobs = lock_blobs(&blobs)?;
+                io_to_py_result!(blob::clear(&mut db, blobs.as_deref_mut()))?;
+                trace_phase!(span, "db");
+                if let Some(filter) = filter {
+                    acquire_lock!(filter)?.clear();
+                }
+                trace_phase!(span, "filter");
                 Ok::<Py<PyAny>, PyErr>(py_none!())
             }),
         )
     }
 
     /// Manually removes dangling key-value pairs in the database file. Like vacuuming.
-    pub fn compact<'a>(&mut self, py: Python<'a>) -> PyResult<&'a PyAny> {
+    pub fn compact<'a>(&self, py: Python<'a>) -> PyResult<&'a PyAny> {
         let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
         let db = self.db.clone();
+        let blobs = self.blobs.clone();
+        let mut span = start_span(&self.tracer, "compact");
+        let filter = self.filter.clone();
 
         pyo3_asyncio::async_std::future_into_py_with_locals(
             py,
             locals.clone(),
             pyo3_asyncio::async_std::scope(locals, async move {
+                trace_phase!(span, "schedule");
                 let mut db = acquire_lock!(db)?;
-                io_to_py_result!(db.compact())?;
+                trace_phase!(span, "lock");
+                let mut blobs = lock_blobs(&blobs)?;
+                io_to_py_result!(blob::compact(&mut db, blobs.as_deref_mut()))?;
+                trace_phase!(span, "db");
+                if let Some(filter) = filter {
+                    io_to_py_result!(acquire_lock!(filter)?.compact(&mut db))?;
+                }
+                trace_phase!(span, "filter");
                 Ok::<Py<PyAny>, PyErr>(py_none!())
             }),
         )
     }
+
+    /// Persists the bloom filter, if any, so that it is trusted on the next start
+    /// even if the process is killed before the store is closed
+    pub fn flush<'a>(&self, py: Python<'a>) -> PyResult<&'a PyAny> {
+        let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
+        let filter = self.filter.clone();
+
+        pyo3_asyncio::async_std::future_into_py_with_locals(
+            py,
+            locals.clone(),
+            pyo3_asyncio::async_std::scope(locals, async move {
+                if let Some(filter) = filter {
+                    io_to_py_result!(acquire_lock!(filter)?.persist())?;
+                }
+                Ok::<Py<PyAny>, PyErr>(py_none!())
+            }),
+        )
+    }
+
+    /// Returns a pipeline on which many operations can be queued,
+    /// to be run later under a single lock on the store
+    pub fn pipeline(&self) -> Pipeline {
+        Pipeline::new(
+            self.db.clone(),
+            self.filter.clone(),
+            self.blobs.clone(),
+            self.tracer.clone(),
+        )
+    }
+
+    /// Sets the callback to be called with the per-phase timings of a sample of operations.
+    ///
+    /// Passing None disables tracing. It can be called while other tasks are using the store
+    #[args(callback, sample_rate = "1.0")]
+    pub fn set_trace_callback(&self, callback: Option<PyObject>, sample_rate: f64) -> PyResult<()> {
+        self.tracer.set(callback, sample_rate)
+    }
+
+    /// Returns the number of lookups made against the bloom filter and how many of them
+    /// were answered without touching the database file, or None if the filter is disabled
+    pub fn bloom_filter_stats(&self) -> Option<HashMap<&'static str, u64>> {
+        self.filter_stats.as_ref().map(|stats| {
+            let (lookups, short_circuits) = stats.get();
+            HashMap::from([("lookups", lookups), ("short_circuits", short_circuits)])
+        })
+    }
+}
+
+/// Returns false if the bloom filter is sure the key is not in the store
+pub(crate) fn may_contain(filter: &Option<Arc<Mutex<BloomFilter>>>, k: &[u8]) -> PyResult<bool> {
+    match filter {
+        None => Ok(true),
+        Some(filter) => Ok(acquire_lock!(filter)?.may_contain(k)),
+    }
+}
+
+/// Locks the blob store, if there is one.
+///
+/// It should only be called while holding the lock on the db
+pub(crate) fn lock_blobs(
+    blobs: &Option<Arc<Mutex<BlobStore>>>,
+) -> PyResult<Option<MutexGuard<BlobStore>>> {
+    blobs.as_ref().map(|blobs| acquire_lock!(blobs)).transpose()
 }
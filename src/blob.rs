@@ -0,0 +1,814 @@
+use crate::crc::crc32;
+use std::collections::HashMap;
+use std::fs::{self, File, OpenOptions};
+use std::io::{self, BufReader, Read, Seek, SeekFrom, Write};
+use std::path::{Path, PathBuf};
+use std::thread;
+use std::time::{SystemTime, UNIX_EPOCH};
+
+/// The name of the folder, next to `dump.scdb`, where large values are stored
+const DIR_NAME: &str = "blobs";
+const SEGMENT_EXTENSION: &str = "blob";
+/// The size after which new large values are appended to a new segment file
+const SEGMENT_SIZE: u64 = 64 * 1024 * 1024;
+/// The maximum number of segment files kept open at once
+const MAX_OPEN_SEGMENTS: usize = 16;
+/// The first byte of a pointer to a large value.
+/// It can never start a value saved by python since it is not valid UTF-8.
+const POINTER_MARKER: u8 = 0xff;
+/// marker (1) + segment id (8) + value offset (8) + value size (8)
+const POINTER_SIZE: usize = 25;
+/// key size (4) + value size (8) + expiry (8) + checksum (4)
+const RECORD_HEADER_SIZE: u64 = 24;
+/// The checksum covers the rest of the header, the key and the value
+const CHECKSUM_OFFSET: usize = 20;
+/// The key of the records that `verify` writes over corrupted ones.
+/// It can never be a key set by python since it is not valid UTF-8.
+const PADDING_KEY: &[u8] = &[0xff];
+/// How much of a segment is read at a time when looking for the next intact record
+const SEARCH_WINDOW_SIZE: u64 = 1024 * 1024;
+
+/// A record in a segment file
+struct Record {
+    key: Vec<u8>,
+    value_offset: u64,
+    value_size: u64,
+    /// The unix timestamp in seconds after which the record is dead, or 0 if it never expires
+    expiry: u64,
+}
+
+impl Record {
+    fn size(&self) -> u64 {
+        RECORD_HEADER_SIZE + self.key.len() as u64 + self.value_size
+    }
+}
+
+/// Holds large values out of line, in append-only segment files, so that they don't
+/// crowd out small values and index blocks from the buffer pool of the main store.
+///
+/// The main store holds a pointer to each large value instead of the value itself.
+/// Compaction only touches sealed segments that are mostly dead or small, moving their
+/// live values to the newest segment and then deleting the segment.
+///
+/// Several blob stores, in this or other processes, can append to the same segments since
+/// each record is appended at the end of the file, as found under an exclusive lock on it.
+/// Recovery and compaction hold the same lock on the segment they work on.
+pub(crate) struct BlobStore {
+    dir: PathBuf,
+    threshold: usize,
+    segments: HashMap<u64, File>,
+    active_id: u64,
+}
+
+impl BlobStore {
+    /// Opens the blob store of the store at `store_path`.
+    ///
+    /// Values of at least `threshold` bytes are stored in it.
+    /// If `threshold` is None, and the store has never stored large values, None is returned.
+    /// Otherwise, the blob store is opened, only for reading the large values already stored.
+    ///
+    /// Any partially written record at the end of the newest segment is removed.
+    pub(crate) fn open(store_path: &str, threshold: Option<usize>) -> io::Result<Option<Self>> {
+        let dir = Path::new(store_path).join(DIR_NAME);
+        if threshold.is_none() && !dir.exists() {
+            return Ok(None);
+        }
+
+        fs::create_dir_all(&dir)?;
+        let active_id = segment_ids(&dir)?.into_iter().max().unwrap_or(0);
+        let mut store = Self {
+            dir,
+            threshold: threshold.unwrap_or(usize::MAX),
+            segments: HashMap::new(),
+            active_id,
+        };
+        store.recover(active_id)?;
+        Ok(Some(store))
+    }
+
+    /// Returns true if the value should be stored out of line
+    #[inline]
+    pub(crate) fn is_large(&self, value: &[u8]) -> bool {
+        value.len() >= self.threshold
+    }
+
+    /// Appends the key-value to the newest segment, returning the pointer to the value
+    pub(crate) fn put(&mut self, key: &[u8], value: &[u8], expiry: u64) -> io::Result<Vec<u8>> {
+        let record = encode_record(key, value, expiry);
+        loop {
+            let id = self.active_id;
+            let path = self.segment_path(id);
+            let file = self.segment(id, true)?;
+            file.lock()?;
+            let res = append(file, &path, &record);
+            file.unlock()?;
+
+            match res? {
+                Some(offset) => {
+                    let value_offset = offset + RECORD_HEADER_SIZE + key.len() as u64;
+                    return Ok(pointer(id, value_offset, value.len() as u64));
+                }
+                None => {
+                    self.segments.remove(&id);
+                    self.roll()?;
+                }
+            }
+        }
+    }
+
+    /// Returns the large value the given pointer of the key points to, or None if its record
+    /// is missing or corrupted e.g. because `verify` dropped it
+    fn read_pointer(&mut self, key: &[u8], ptr: &[u8]) -> io::Result<Option<Vec<u8>>> {
+        let id = u64::from_be_bytes(ptr[1..9].try_into().unwrap());
+        let offset = u64::from_be_bytes(ptr[9..17].try_into().unwrap());
+        let size = u64::from_be_bytes(ptr[17..25].try_into().unwrap());
+        match self.read(id, key, offset, size) {
+            Ok(value) => Ok(Some(value)),
+            Err(e) if is_lost(&e) => Ok(None),
+            Err(e) => Err(e),
+        }
+    }
+
+    /// Deletes all segments
+    pub(crate) fn clear(&mut self) -> io::Result<()> {
+        self.segments.clear();
+        for id in segment_ids(&self.dir)? {
+            fs::remove_file(self.segment_path(id))?;
+        }
+        // ids are not reused, so that other stores still holding a removed segment open notice it is gone
+        self.active_id += 1;
+        Ok(())
+    }
+
+    /// Reclaims the space held by dead large values i.e. those that were deleted,
+    /// overwritten or have expired.
+    ///
+    /// A segment with no live values is deleted. A segment that is mostly dead, or a sealed
+    /// segment smaller than half a full one, has its live values moved to the newest segment,
+    /// and the pointers in `db` updated, before it is deleted. Other segments are left as they are.
+    /// The newest segment is only sealed here if it is mostly dead, and its live values then
+    /// start the new one, so calling this often does not leave behind many small segments.
+    /// Since a segment is only deleted after no pointers refer to it, a crash midway
+    /// leaves every pointer valid.
+    ///
+    /// Segments newer than this store's newest one are being appended to by other stores,
+    /// and are left alone. Each segment is locked while it is compacted, always before the
+    /// newer segment its values are moved to, so that stores appending to it wait and then
+    /// move on to a newer segment. Pointers set by other stores meanwhile are not seen here,
+    /// so no other store may write to `db` while this runs.
+    pub(crate) fn compact(&mut self, db: &mut scdb::Store) -> io::Result<()> {
+        let now = now();
+        for id in segment_ids(&self.dir)? {
+            if id > self.active_id {
+                break;
+            }
+
+            let lock = self.segment(id, false)?.try_clone()?;
+            lock.lock()?;
+            let res = self.compact_segment(db, id, lock.metadata()?.len(), now);
+            lock.unlock()?;
+            res?;
+        }
+
+        Ok(())
+    }
+
+    /// Moves the live values of the given locked segment to the newest segment and deletes it,
+    /// if it is mostly dead or small
+    fn compact_segment(
+        &mut self,
+        db: &mut scdb::Store,
+        id: u64,
+        segment_size: u64,
+        now: u64,
+    ) -> io::Result<()> {
+        let is_active = id == self.active_id;
+        if is_active && segment_size == 0 {
+            return Ok(());
+        }
+
+        // scdb alone decides whether a value has expired, since its expiry is computed
+        // a little after the one in the record
+        let mut live = vec![];
+        let mut live_size = 0;
+        for record in self.scan(id)? {
+            let current = db.get(&record.key)?;
+            let ptr = pointer(id, record.value_offset, record.value_size);
+            if current.as_deref() == Some(&ptr[..]) {
+                live_size += record.size();
+                live.push(record);
+            }
+        }
+
+        let is_small = !is_active && segment_size * 2 < SEGMENT_SIZE;
+        if live_size * 2 > segment_size && !is_small {
+            return Ok(());
+        }
+        if is_active {
+            self.roll()?;
+        }
+
+        let mut written_ids = vec![];
+        for record in live {
+            let value = match self.read(id, &record.key, record.value_offset, record.value_size) {
+                Ok(value) => value,
+                Err(e) if is_lost(&e) => {
+                    db.delete(&record.key)?;
+                    continue;
+                }
+                Err(e) => return Err(e),
+            };
+            let ptr = self.put(&record.key, &value, record.expiry)?;
+            let ttl = match record.expiry {
+                0 => None,
+                expiry => Some(expiry.saturating_sub(now).max(1)),
+            };
+            db.set(&record.key, &ptr, ttl)?;
+            if !written_ids.contains(&self.active_id) {
+                written_ids.push(self.active_id);
+            }
+        }
+
+        // the moved values must reach the disk before their old copies are deleted,
+        // or a power loss could leave pointers to neither
+        for written_id in written_ids {
+            self.segment(written_id, false)?.sync_data()?;
+        }
+        self.segments.remove(&id);
+        fs::remove_file(self.segment_path(id))
+    }
+
+    /// Starts appending to a newer segment: the newest one if another store has already
+    /// started it, or else a new one
+    fn roll(&mut self) -> io::Result<()> {
+        let newest_id = segment_ids(&self.dir)?.into_iter().max().unwrap_or(0);
+        self.active_id = if newest_id > self.active_id {
+            newest_id
+        } else {
+            self.active_id + 1
+        };
+        self.segment(self.active_id, true)?;
+        Ok(())
+    }
+
+    /// Truncates any partially written or corrupted records at the end of the given
+    /// segment e.g. after a crash.
+    ///
+    /// The segment is locked meanwhile, so a record being appended by another store is
+    /// only checked once it is whole.
+    fn recover(&mut self, id: u64) -> io::Result<()> {
+        let file = self.segment(id, true)?;
+        file.lock()?;
+        let res = truncate_torn_tail(file);
+        file.unlock()?;
+        res
+    }
+
+    /// Returns all records in the given segment.
+    ///
+    /// The records are found from their headers alone. Only if the headers do not lead
+    /// to the end of the file is every record checked, skipping the bad ones.
+    fn scan(&mut self, id: u64) -> io::Result<Vec<Record>> {
+        let file = self.segment(id, false)?;
+        let file_size = file.metadata()?.len();
+        let mut records = vec![];
+        let mut offset = 0;
+        let mut header = [0u8; RECORD_HEADER_SIZE as usize];
+
+        while offset + RECORD_HEADER_SIZE <= file_size {
+            file.seek(SeekFrom::Start(offset))?;
+            file.read_exact(&mut header)?;
+            let (key_size, value_size) = record_sizes(&header);
+            let expiry = u64::from_be_bytes(header[12..20].try_into().unwrap());
+            if record_end(offset, key_size, value_size, file_size).is_none() {
+                break;
+            }
+            let mut key = vec![0u8; key_size as usize];
+            file.read_exact(&mut key)?;
+
+            let record = Record {
+                key,
+                value_offset: offset + RECORD_HEADER_SIZE + key_size,
+                value_size,
+                expiry,
+            };
+            offset += record.size();
+            records.push(record);
+        }
+
+        if offset == file_size {
+            return Ok(records);
+        }
+        Ok(check(file, file_size)?.records)
+    }
+
+    /// Reads the value of the record of the given key, checking that the record is intact
+    fn read(
+        &mut self,
+        id: u64,
+        key: &[u8],
+        value_offset: u64,
+        value_size: u64,
+    ) -> io::Result<Vec<u8>> {
+        let record_offset = value_offset
+            .checked_sub(RECORD_HEADER_SIZE + key.len() as u64)
+            .ok_or_else(|| corrupted(key))?;
+        let file = self.segment(id, false)?;
+        let file_size = file.metadata()?.len();
+        if record_end(record_offset, key.len() as u64, value_size, file_size).is_none() {
+            return Err(corrupted(key));
+        }
+        file.seek(SeekFrom::Start(record_offset))?;
+        let mut header = [0u8; RECORD_HEADER_SIZE as usize];
+        let mut record_key = vec![0u8; key.len()];
+        let mut value = vec![0u8; value_size as usize];
+        file.read_exact(&mut header)?;
+        file.read_exact(&mut record_key)?;
+        file.read_exact(&mut value)?;
+
+        let (key_size, size) = record_sizes(&header);
+        if key_size != key.len() as u64
+            || size != value_size
+            || record_key != key
+            || !is_intact(&header, key, &value)
+        {
+            return Err(corrupted(key));
+        }
+        Ok(value)
+    }
+
+    /// Returns the open file of the given segment.
+    ///
+    /// If too many segments are open, all but the newest are closed first.
+    fn segment(&mut self, id: u64, create: bool) -> io::Result<&mut File> {
+        if !self.segments.contains_key(&id) {
+            if self.segments.len() >= MAX_OPEN_SEGMENTS {
+                let active_id = self.active_id;
+                self.segments.retain(|id, _| *id == active_id);
+            }
+            let file = OpenOptions::new()
+                .read(true)
+                .append(true)
+                .create(create)
+                .open(self.segment_path(id))?;
+            self.segments.insert(id, file);
+        }
+        Ok(self.segments.get_mut(&id).unwrap())
+    }
+
+    fn segment_path(&self, id: u64) -> PathBuf {
+        self.dir.join(segment_file_name(id))
+    }
+}
+
+/// Sets the key-value in `db`, storing the value in `blobs` instead if it is large
+pub(crate) fn set(
+    db: &mut scdb::Store,
+    blobs: Option<&mut BlobStore>,
+    k: &[u8],
+    v: &[u8],
+    ttl: Option<u64>,
+) -> io::Result<()> {
+    match blobs {
+        Some(blobs) if blobs.is_large(v) => {
+            let expiry = ttl.map_or(0, |ttl| now() + ttl);
+            let ptr = blobs.put(k, v, expiry)?;
+            db.set(k, &ptr, ttl)
+        }
+        _ => db.set(k, v, ttl),
+    }
+}
+
+/// Gets the value for the key from `db`, reading it from `blobs` if it is large
+pub(crate) fn get(
+    db: &mut scdb::Store,
+    blobs: Option<&mut BlobStore>,
+    k: &[u8],
+) -> io::Result<Option<Vec<u8>>> {
+    match (db.get(k)?, blobs) {
+        (Some(v), Some(blobs)) => resolve(db, blobs, k, v),
+        (value, _) => Ok(value),
+    }
+}
+
+/// Searches `db` for key-values whose key start with `term`, reading large values from `blobs`
+pub(crate) fn search(
+    db: &mut scdb::Store,
+    blobs: Option<&mut BlobStore>,
+    term: &[u8],
+    skip: u64,
+    limit: u64,
+) -> io::Result<Vec<(Vec<u8>, Vec<u8>)>> {
+    let res = db.search(term, skip, limit)?;
+    match blobs {
+        None => Ok(res),
+        Some(blobs) => {
+            let mut found = Vec::with_capacity(res.len());
+            for (k, v) in res {
+                if let Some(v) = resolve(db, blobs, &k, v)? {
+                    found.push((k, v));
+                }
+            }
+            Ok(found)
+        }
+    }
+}
+
+/// Returns the large value the stored value of the key points to, or the stored value itself
+/// if it is not a pointer.
+///
+/// If the large value was lost e.g. dropped by `verify`, the key is deleted and None is returned.
+fn resolve(
+    db: &mut scdb::Store,
+    blobs: &mut BlobStore,
+    k: &[u8],
+    mut stored: Vec<u8>,
+) -> io::Result<Option<Vec<u8>>> {
+    while stored.len() == POINTER_SIZE && stored[0] == POINTER_MARKER {
+        if let Some(value) = blobs.read_pointer(k, &stored)? {
+            return Ok(Some(value));
+        }
+        match db.get(k)? {
+            // the value was moved meanwhile e.g. by the compaction of another store
+            Some(current) if current != stored => stored = current,
+            Some(_) => {
+                db.delete(k)?;
+                return Ok(None);
+            }
+            None => return Ok(None),
+        }
+    }
+    Ok(Some(stored))
+}
+
+/// Clears `db` and `blobs`
+pub(crate) fn clear(db: &mut scdb::Store, blobs: Option<&mut BlobStore>) -> io::Result<()> {
+    db.clear()?;
+    match blobs {
+        None => Ok(()),
+        Some(blobs) => blobs.clear(),
+    }
+}
+
+/// Compacts `db` and `blobs`
+pub(crate) fn compact(db: &mut scdb::Store, blobs: Option<&mut BlobStore>) -> io::Result<()> {
+    db.compact()?;
+    match blobs {
+        None => Ok(()),
+        Some(blobs) => blobs.compact(db),
+    }
+}
+
+/// Checks every record in the segment files of the store at `store_path`, a share of the
+/// segments on each available thread, returning the problems found.
+///
+/// If `repair` is true, the torn or corrupted records at the end of each segment are
+/// truncated, as is done for the newest segment when the store is opened, and the other
+/// bad records are overwritten with padding, so that the intact records after them keep
+/// their offsets. The pointers to the dropped records are left in `dump.scdb`; the keys
+/// read as absent, and are deleted, from then on.
+/// No store may be open while repairing.
+pub(crate) fn verify(store_path: &str, repair: bool) -> io::Result<Vec<String>> {
+    let dir = Path::new(store_path).join(DIR_NAME);
+    if !dir.exists() {
+        return Ok(vec![]);
+    }
+
+    let ids = segment_ids(&dir)?;
+    let threads = thread::available_parallelism().map_or(1, |n| n.get());
+    let chunk_size = ((ids.len() + threads - 1) / threads).max(1);
+    thread::scope(|scope| {
+        let handles: Vec<_> = ids
+            .chunks(chunk_size)
+            .map(|ids| {
+                let dir = &dir;
+                scope.spawn(move || -> io::Result<Vec<String>> {
+                    let mut problems = vec![];
+                    for id in ids {
+                        problems.extend(verify_segment(dir, *id, repair)?);
+                    }
+                    Ok(problems)
+                })
+            })
+            .collect();
+
+        let mut problems = vec![];
+        for handle in handles {
+            let res = handle.join().map_err(|_| {
+                io::Error::new(io::ErrorKind::Other, "verification thread panicked")
+            })?;
+            problems.extend(res?);
+        }
+        Ok(problems)
+    })
+}
+
+/// Checks every record in the given segment, dropping the bad ones if `repair` is true
+fn verify_segment(dir: &Path, id: u64, repair: bool) -> io::Result<Vec<String>> {
+    let mut file = OpenOptions::new()
+        .read(true)
+        .write(repair)
+        .open(dir.join(segment_file_name(id)))?;
+    // records being appended by an open store are only checked once they are whole
+    file.lock()?;
+    let file_size = file.metadata()?.len();
+    let check = check(&mut file, file_size)?;
+
+    let mut problems = vec![];
+    for (offset, size) in check.bad {
+        if repair {
+            file.seek(SeekFrom::Start(offset))?;
+            file.write_all(&padding(size))?;
+        }
+        problems.push(format!(
+            "{}/{}: {} bytes of corrupted records at offset {}",
+            DIR_NAME,
+            segment_file_name(id),
+            size,
+            offset
+        ));
+    }
+    if check.valid_size < file_size {
+        if repair {
+            file.set_len(check.valid_size)?;
+        }
+        problems.push(format!(
+            "{}/{}: {} bytes of torn or corrupted records from offset {}",
+            DIR_NAME,
+            segment_file_name(id),
+            file_size - check.valid_size,
+            check.valid_size
+        ));
+    }
+    if repair && !problems.is_empty() {
+        file.sync_data()?;
+    }
+    Ok(problems)
+}
+
+/// Appends the record to the given locked segment file, returning the offset it was written at,
+/// or None if the segment is full, or was removed by the compaction of another store
+fn append(file: &mut File, path: &Path, record: &[u8]) -> io::Result<Option<u64>> {
+    if !path.exists() {
+        return Ok(None);
+    }
+    let offset = file.metadata()?.len();
+    if offset >= SEGMENT_SIZE {
+        return Ok(None);
+    }
+
+    if let Err(e) = file.write_all(record) {
+        let _ = file.set_len(offset);
+        return Err(e);
+    }
+    Ok(Some(offset))
+}
+
+/// Truncates the given segment file after its last intact record
+fn truncate_torn_tail(file: &mut File) -> io::Result<()> {
+    let file_size = file.metadata()?.len();
+    let valid_size = check(file, file_size)?.valid_size;
+    if valid_size < file_size {
+        file.set_len(valid_size)?;
+    }
+    Ok(())
+}
+
+fn pointer(id: u64, offset: u64, size: u64) -> Vec<u8> {
+    let mut ptr = Vec::with_capacity(POINTER_SIZE);
+    ptr.push(POINTER_MARKER);
+    ptr.extend_from_slice(&id.to_be_bytes());
+    ptr.extend_from_slice(&offset.to_be_bytes());
+    ptr.extend_from_slice(&size.to_be_bytes());
+    ptr
+}
+
+/// The outcome of checking every record in a segment file
+struct Check {
+    /// The intact records
+    records: Vec<Record>,
+    /// The (offset, size) of each run of bad records followed by an intact one
+    bad: Vec<(u64, u64)>,
+    /// The offset just past the last intact record. Anything after it is torn or corrupted.
+    valid_size: u64,
+}
+
+/// Checks every record in the given segment file.
+///
+/// After a bad record, the next intact one is looked for at every offset,
+/// since the sizes in a bad header cannot be trusted.
+fn check(file: &mut File, file_size: u64) -> io::Result<Check> {
+    let mut records = vec![];
+    let mut bad = vec![];
+    let mut offset = 0;
+    loop {
+        offset = intact_run(file, offset, file_size, &mut records)?;
+        if offset == file_size {
+            break;
+        }
+        // a bad record takes up at least a header
+        match find_intact(file, offset + RECORD_HEADER_SIZE, file_size)? {
+            Some(next) => {
+                bad.push((offset, next - offset));
+                offset = next;
+            }
+            None => break,
+        }
+    }
+
+    Ok(Check {
+        records,
+        bad,
+        valid_size: offset,
+    })
+}
+
+/// Reads the run of intact records starting at `from`, adding them to `records`,
+/// and returns the offset just past the last of them
+fn intact_run(
+    file: &mut File,
+    from: u64,
+    file_size: u64,
+    records: &mut Vec<Record>,
+) -> io::Result<u64> {
+    file.seek(SeekFrom::Start(from))?;
+    let mut reader = BufReader::new(file);
+    let mut offset = from;
+    let mut header = [0u8; RECORD_HEADER_SIZE as usize];
+
+    while offset + RECORD_HEADER_SIZE <= file_size {
+        reader.read_exact(&mut header)?;
+        let (key_size, value_size) = record_sizes(&header);
+        let end = match record_end(offset, key_size, value_size, file_size) {
+            Some(end) => end,
+            None => break,
+        };
+
+        let mut key = vec![0u8; key_size as usize];
+        let mut value = vec![0u8; value_size as usize];
+        reader.read_exact(&mut key)?;
+        reader.read_exact(&mut value)?;
+        if !is_intact(&header, &key, &value) {
+            break;
+        }
+        records.push(Record {
+            key,
+            value_offset: offset + RECORD_HEADER_SIZE + key_size,
+            value_size,
+            expiry: u64::from_be_bytes(header[12..20].try_into().unwrap()),
+        });
+        offset = end;
+    }
+
+    Ok(offset)
+}
+
+/// Returns the offset of the first intact record at or after `from`, or None if there is none
+fn find_intact(file: &mut File, from: u64, file_size: u64) -> io::Result<Option<u64>> {
+    let header_size = RECORD_HEADER_SIZE as usize;
+    let mut window = vec![];
+    let mut start = from;
+
+    while start + RECORD_HEADER_SIZE <= file_size {
+        let len = (file_size - start).min(SEARCH_WINDOW_SIZE) as usize;
+        window.resize(len, 0);
+        file.seek(SeekFrom::Start(start))?;
+        file.read_exact(&mut window)?;
+
+        for i in 0..=len - header_size {
+            let offset = start + i as u64;
+            let header = &window[i..i + header_size];
+            let (key_size, value_size) = record_sizes(header);
+            let end = match record_end(offset, key_size, value_size, file_size) {
+                Some(end) => end,
+                None => continue,
+            };
+
+            let record_end_in_window = (end - start) as usize;
+            let is_intact = if record_end_in_window <= len {
+                let key_end = i + header_size + key_size as usize;
+                is_intact(
+                    header,
+                    &window[i + header_size..key_end],
+                    &window[key_end..record_end_in_window],
+                )
+            } else {
+                is_intact_at(file, offset, key_size, value_size)?
+            };
+            if is_intact {
+                return Ok(Some(offset));
+            }
+        }
+        start += (len - header_size + 1) as u64;
+    }
+
+    Ok(None)
+}
+
+/// Checks the record of the given sizes at `offset` in the given segment file
+fn is_intact_at(file: &mut File, offset: u64, key_size: u64, value_size: u64) -> io::Result<bool> {
+    let mut header = [0u8; RECORD_HEADER_SIZE as usize];
+    let mut key = vec![0u8; key_size as usize];
+    let mut value = vec![0u8; value_size as usize];
+    file.seek(SeekFrom::Start(offset))?;
+    file.read_exact(&mut header)?;
+    file.read_exact(&mut key)?;
+    file.read_exact(&mut value)?;
+    Ok(is_intact(&header, &key, &value))
+}
+
+/// Returns the bytes of a record with its checksum
+fn encode_record(key: &[u8], value: &[u8], expiry: u64) -> Vec<u8> {
+    let mut record = Vec::with_capacity(RECORD_HEADER_SIZE as usize + key.len() + value.len());
+    record.extend_from_slice(&(key.len() as u32).to_be_bytes());
+    record.extend_from_slice(&(value.len() as u64).to_be_bytes());
+    record.extend_from_slice(&expiry.to_be_bytes());
+    let checksum = crc32(&[&record, key, value]);
+    record.extend_from_slice(&checksum.to_be_bytes());
+    record.extend_from_slice(key);
+    record.extend_from_slice(value);
+    record
+}
+
+/// Returns an intact record of the given size, at least a header, that no pointer can refer to
+fn padding(size: u64) -> Vec<u8> {
+    let key = if size > RECORD_HEADER_SIZE {
+        PADDING_KEY
+    } else {
+        &[]
+    };
+    let value_size = size - RECORD_HEADER_SIZE - key.len() as u64;
+    encode_record(key, &vec![0u8; value_size as usize], 0)
+}
+
+/// Returns the (key size, value size) in the header of a record
+fn record_sizes(header: &[u8]) -> (u64, u64) {
+    let key_size = u32::from_be_bytes(header[0..4].try_into().unwrap()) as u64;
+    let value_size = u64::from_be_bytes(header[4..12].try_into().unwrap());
+    (key_size, value_size)
+}
+
+/// Returns the offset just past the record at `offset` with the given sizes, or None if it
+/// would not fit in the file e.g. because its header is garbage
+fn record_end(offset: u64, key_size: u64, value_size: u64, file_size: u64) -> Option<u64> {
+    offset
+        .checked_add(RECORD_HEADER_SIZE)?
+        .checked_add(key_size)?
+        .checked_add(value_size)
+        .filter(|end| *end <= file_size)
+}
+
+/// Checks the checksum in the header of a record against the rest of the record
+fn is_intact(header: &[u8], key: &[u8], value: &[u8]) -> bool {
+    let checksum = u32::from_be_bytes(header[CHECKSUM_OFFSET..].try_into().unwrap());
+    checksum == crc32(&[&header[..CHECKSUM_OFFSET], key, value])
+}
+
+/// Returns true if the error means that the record read is missing or corrupted
+fn is_lost(e: &io::Error) -> bool {
+    matches!(
+        e.kind(),
+        io::ErrorKind::InvalidData | io::ErrorKind::UnexpectedEof | io::ErrorKind::NotFound
+    )
+}
+
+fn corrupted(key: &[u8]) -> io::Error {
+    io::Error::new(
+        io::ErrorKind::InvalidData,
+        format!(
+            "the large value of '{}' is corrupted",
+            String::from_utf8_lossy(key)
+        ),
+    )
+}
+
+fn segment_file_name(id: u64) -> String {
+    format!("{:010}.{}", id, SEGMENT_EXTENSION)
+}
+
+/// Returns the ids of all segments in the given folder
+fn segment_ids(dir: &Path) -> io::Result<Vec<u64>> {
+    let mut ids = vec![];
+    for entry in fs::read_dir(dir)? {
+        let path = entry?.path();
+        if path.extension().and_then(|ext| ext.to_str()) != Some(SEGMENT_EXTENSION) {
+            continue;
+        }
+        if let Some(id) = path
+            .file_stem()
+            .and_then(|s| s.to_str())
+            .and_then(|s| s.parse().ok())
+        {
+            ids.push(id);
+        }
+    }
+    ids.sort_unstable();
+    Ok(ids)
+}
+
+/// Returns the current unix timestamp in seconds
+fn now() -> u64 {
+    SystemTime::now()
+        .duration_since(UNIX_EPOCH)
+        .map_or(0, |d| d.as_secs())
+}
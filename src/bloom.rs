@@ -0,0 +1,389 @@
+use crate::crc::crc32;
+use std::fs::{self, File, OpenOptions};
+use std::io::{self, Seek, SeekFrom, Write};
+use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::Arc;
+
+/// The name of the file, next to `dump.scdb`, where the bloom filter is persisted
+const FILE_NAME: &str = "bloom.scdb";
+const DB_FILE_NAME: &str = "dump.scdb";
+/// The bytes every bloom filter file starts with
+const MAGIC: &[u8; 8] = b"scdbblm1";
+/// magic (8) + is_clean (1) + num_hashes (4) + num_bits (8)
+const HEADER_SIZE: usize = 21;
+const CLEAN_FLAG_OFFSET: u64 = 8;
+/// The file ends with a checksum of everything before it but the clean flag,
+/// which is changed in place
+const CHECKSUM_SIZE: usize = 4;
+/// The default `max_keys` of scdb
+const DEFAULT_MAX_KEYS: u64 = 1_000_000;
+/// How many key-values are read from the store at a time when listing its keys
+const LIST_PAGE_SIZE: u64 = 1_000;
+
+/// An in-memory bloom filter of all keys in the store.
+///
+/// It answers "definitely absent" for keys that were never set, without touching the
+/// database file. It is persisted next to `dump.scdb` on `flush()`, on `compact()` and when
+/// the store is closed. Before the first change after it is persisted, the file on disk is
+/// marked as dirty so that if the process dies, the stale filter is not trusted on the next start.
+pub(crate) struct BloomFilter {
+    path: PathBuf,
+    bits: Vec<u64>,
+    num_bits: u64,
+    num_hashes: u32,
+    configured_num_bits: u64,
+    configured_num_hashes: u32,
+    /// Whether the filter is known to contain every key in the store.
+    /// An untrusted filter lets every lookup through until it is cleared or rebuilt.
+    is_trusted: bool,
+    /// Whether the file on disk is marked as clean, so it has to be marked as dirty
+    /// before any key is added
+    is_clean_on_disk: bool,
+    /// Whether the store was opened with search enabled, so that its keys can be listed
+    /// to rebuild the filter
+    can_rebuild: bool,
+    stats: Arc<Stats>,
+}
+
+/// The counts of lookups made against a bloom filter since the store was opened,
+/// which can be read without locking the filter.
+///
+/// `short_circuits` is the number of lookups that never reached the database file.
+#[derive(Default)]
+pub(crate) struct Stats {
+    lookups: AtomicU64,
+    short_circuits: AtomicU64,
+}
+
+impl Stats {
+    /// Returns the (lookups, short_circuits) counts
+    pub(crate) fn get(&self) -> (u64, u64) {
+        (
+            self.lookups.load(Ordering::Relaxed),
+            self.short_circuits.load(Ordering::Relaxed),
+        )
+    }
+}
+
+impl BloomFilter {
+    /// Opens the bloom filter for the store at `store_path`, creating a new one if none exists.
+    ///
+    /// This must be called before the store itself is opened so as to know whether the
+    /// database file existed before.
+    pub(crate) fn open(
+        store_path: &str,
+        max_keys: Option<u64>,
+        false_positive_rate: f64,
+        is_search_enabled: bool,
+    ) -> io::Result<Self> {
+        if !(false_positive_rate > 0.0 && false_positive_rate < 1.0) {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidInput,
+                "bloom_filter_fp_rate should be greater than 0 and less than 1",
+            ));
+        }
+
+        let store_path = Path::new(store_path);
+        let path = store_path.join(FILE_NAME);
+        let is_new_store = !store_path.join(DB_FILE_NAME).exists();
+        let (num_bits, num_hashes) =
+            optimal_size(max_keys.unwrap_or(DEFAULT_MAX_KEYS), false_positive_rate);
+
+        let mut filter = Self {
+            path,
+            bits: vec![0; words_for(num_bits)],
+            num_bits,
+            num_hashes,
+            configured_num_bits: num_bits,
+            configured_num_hashes: num_hashes,
+            is_trusted: is_new_store,
+            is_clean_on_disk: false,
+            can_rebuild: is_search_enabled,
+            stats: Arc::default(),
+        };
+
+        if !is_new_store {
+            filter.load()?;
+        }
+
+        Ok(filter)
+    }
+
+    /// Removes any persisted bloom filter for the store at `store_path`.
+    ///
+    /// This is called when a store is opened without a bloom filter, since any keys set
+    /// in that session would be missing from the persisted filter.
+    pub(crate) fn invalidate(store_path: &str) -> io::Result<()> {
+        match fs::remove_file(Path::new(store_path).join(FILE_NAME)) {
+            Err(e) if e.kind() != io::ErrorKind::NotFound => Err(e),
+            _ => Ok(()),
+        }
+    }
+
+    /// Returns false if the key is definitely not in the store
+    pub(crate) fn may_contain(&mut self, key: &[u8]) -> bool {
+        if !self.is_trusted {
+            return true;
+        }
+
+        self.stats.lookups.fetch_add(1, Ordering::Relaxed);
+        let (h1, h2) = hash(key);
+        for i in 0..self.num_hashes as u64 {
+            if !self.get_bit(index(h1, h2, i, self.num_bits)) {
+                self.stats.short_circuits.fetch_add(1, Ordering::Relaxed);
+                return false;
+            }
+        }
+        true
+    }
+
+    /// Adds the given key to the filter.
+    ///
+    /// This must be called before the key is set in the store, so that the file on disk
+    /// is marked as dirty first if the filter had been persisted.
+    pub(crate) fn insert(&mut self, key: &[u8]) -> io::Result<()> {
+        if self.is_clean_on_disk {
+            self.mark_dirty()?;
+        }
+        self.add(key);
+        Ok(())
+    }
+
+    /// Empties the filter, resizing it to the configured false-positive rate.
+    ///
+    /// An untrusted filter becomes trusted again since the store is now empty.
+    /// A clean file on disk is left as it is since it still holds every key in the store.
+    pub(crate) fn clear(&mut self) {
+        self.num_bits = self.configured_num_bits;
+        self.num_hashes = self.configured_num_hashes;
+        self.bits = vec![0; words_for(self.num_bits)];
+        self.is_trusted = true;
+    }
+
+    /// Rebuilds the filter from the keys in the store and persists it.
+    ///
+    /// The filter can only be rebuilt if the store was opened with search enabled,
+    /// since scdb cannot otherwise list its keys. Without search, the filter keeps the keys
+    /// that were deleted or have expired, and an untrusted filter stays untrusted
+    /// until the store is cleared.
+    /// If listing the keys fails, the filter is left as it was.
+    pub(crate) fn compact(&mut self, db: &mut scdb::Store) -> io::Result<()> {
+        if self.can_rebuild {
+            let num_bits = self.configured_num_bits;
+            let num_hashes = self.configured_num_hashes;
+            let mut bits = vec![0; words_for(num_bits)];
+            for_each_key(db, |k| set_bits(&mut bits, num_bits, num_hashes, &k))?;
+
+            self.bits = bits;
+            self.num_bits = num_bits;
+            self.num_hashes = num_hashes;
+            self.is_trusted = true;
+        }
+        self.persist()
+    }
+
+    /// Writes the filter to disk, marked as clean, if it is trusted
+    pub(crate) fn persist(&mut self) -> io::Result<()> {
+        if !self.is_trusted {
+            return Ok(());
+        }
+
+        let mut data = Vec::with_capacity(HEADER_SIZE + self.bits.len() * 8);
+        data.extend_from_slice(MAGIC);
+        data.push(1);
+        data.extend_from_slice(&self.num_hashes.to_le_bytes());
+        data.extend_from_slice(&self.num_bits.to_le_bytes());
+        for word in &self.bits {
+            data.extend_from_slice(&word.to_le_bytes());
+        }
+        let checksum = checksum(&data);
+        data.extend_from_slice(&checksum.to_le_bytes());
+
+        let tmp_path = self.path.with_extension("tmp");
+        let mut file = File::create(&tmp_path)?;
+        file.write_all(&data)?;
+        file.sync_all()?;
+        fs::rename(&tmp_path, &self.path)?;
+        self.is_clean_on_disk = true;
+        Ok(())
+    }
+
+    /// Returns the counts of lookups, which stay up to date as the filter is used
+    pub(crate) fn stats(&self) -> Arc<Stats> {
+        self.stats.clone()
+    }
+
+    /// Loads the persisted filter, if it exists and the store was closed cleanly,
+    /// and then marks the file as dirty
+    fn load(&mut self) -> io::Result<()> {
+        let data = match fs::read(&self.path) {
+            Ok(data) => data,
+            Err(e) if e.kind() == io::ErrorKind::NotFound => return Ok(()),
+            Err(e) => return Err(e),
+        };
+
+        let (num_hashes, num_bits, bits) = match parse(&data) {
+            Some(filter) if data[CLEAN_FLAG_OFFSET as usize] == 1 => filter,
+            _ => return Ok(()),
+        };
+
+        self.bits = bits;
+        self.num_bits = num_bits;
+        self.num_hashes = num_hashes;
+        self.is_trusted = true;
+        self.mark_dirty()
+    }
+
+    /// Marks the persisted filter as dirty so that it is not loaded if the process dies
+    fn mark_dirty(&mut self) -> io::Result<()> {
+        let mut file = OpenOptions::new().write(true).open(&self.path)?;
+        file.seek(SeekFrom::Start(CLEAN_FLAG_OFFSET))?;
+        file.write_all(&[0])?;
+        self.is_clean_on_disk = false;
+        Ok(())
+    }
+
+    #[inline]
+    fn add(&mut self, key: &[u8]) {
+        set_bits(&mut self.bits, self.num_bits, self.num_hashes, key);
+    }
+
+    #[inline]
+    fn get_bit(&self, i: u64) -> bool {
+        self.bits[(i / 64) as usize] & (1 << (i % 64)) != 0
+    }
+}
+
+impl Drop for BloomFilter {
+    fn drop(&mut self) {
+        let _ = self.persist();
+    }
+}
+
+/// Calls `f` with every key in the store, which must have been opened with search enabled.
+///
+/// Every key but the empty one is in the search index under its first byte,
+/// so the keys are listed by a search for each byte, a page at a time.
+pub(crate) fn for_each_key(db: &mut scdb::Store, mut f: impl FnMut(Vec<u8>)) -> io::Result<()> {
+    if db.get(b"")?.is_some() {
+        f(vec![]);
+    }
+    for first_byte in 0..=u8::MAX {
+        let mut skip = 0;
+        loop {
+            let page = db.search(&[first_byte], skip, LIST_PAGE_SIZE)?;
+            let is_last = (page.len() as u64) < LIST_PAGE_SIZE;
+            for (k, _) in page {
+                f(k);
+            }
+            if is_last {
+                break;
+            }
+            skip += LIST_PAGE_SIZE;
+        }
+    }
+    Ok(())
+}
+
+/// Checks the persisted bloom filter of the store at `store_path`, if any,
+/// returning the problems found.
+///
+/// If `repair` is true, a corrupted filter is removed so that the next filter starts untrusted.
+pub(crate) fn verify(store_path: &str, repair: bool) -> io::Result<Vec<String>> {
+    let path = Path::new(store_path).join(FILE_NAME);
+    let data = match fs::read(&path) {
+        Ok(data) => data,
+        Err(e) if e.kind() == io::ErrorKind::NotFound => return Ok(vec![]),
+        Err(e) => return Err(e),
+    };
+
+    if parse(&data).is_some() {
+        return Ok(vec![]);
+    }
+    if repair {
+        fs::remove_file(&path)?;
+    }
+    Ok(vec![format!("{}: corrupted bloom filter", FILE_NAME)])
+}
+
+/// Returns the (num_hashes, num_bits, bits) of a persisted filter, clean or not,
+/// or None if it is not a whole filter with a matching checksum
+fn parse(data: &[u8]) -> Option<(u32, u64, Vec<u64>)> {
+    if data.len() < HEADER_SIZE + CHECKSUM_SIZE || &data[..8] != MAGIC {
+        return None;
+    }
+
+    let (data, expected) = data.split_at(data.len() - CHECKSUM_SIZE);
+    if checksum(data) != u32::from_le_bytes(expected.try_into().unwrap()) {
+        return None;
+    }
+
+    let num_hashes = u32::from_le_bytes(data[9..13].try_into().unwrap());
+    let num_bits = u64::from_le_bytes(data[13..21].try_into().unwrap());
+    let body = &data[HEADER_SIZE..];
+    if num_hashes == 0 || num_bits == 0 || body.len() != words_for(num_bits) * 8 {
+        return None;
+    }
+
+    let bits = body
+        .chunks_exact(8)
+        .map(|chunk| u64::from_le_bytes(chunk.try_into().unwrap()))
+        .collect();
+    Some((num_hashes, num_bits, bits))
+}
+
+/// Returns the checksum of the persisted filter, skipping the clean flag
+fn checksum(data: &[u8]) -> u32 {
+    let flag = CLEAN_FLAG_OFFSET as usize;
+    crc32(&[&data[..flag], &data[flag + 1..]])
+}
+
+/// Computes the number of bits and hash functions for `n` keys at false positive rate `p`
+fn optimal_size(n: u64, p: f64) -> (u64, u32) {
+    let n = n.max(1) as f64;
+    let ln2 = std::f64::consts::LN_2;
+    let num_bits = (-n * p.ln() / (ln2 * ln2)).ceil().max(64.0);
+    let num_hashes = (num_bits / n * ln2).round().max(1.0);
+    (num_bits as u64, num_hashes as u32)
+}
+
+#[inline]
+fn words_for(num_bits: u64) -> usize {
+    ((num_bits + 63) / 64) as usize
+}
+
+/// Returns two independent hashes of the key for double hashing.
+///
+/// A hand-rolled FNV-1a is used instead of the std hasher so that
+/// persisted filters remain valid across rust versions.
+#[inline]
+fn hash(key: &[u8]) -> (u64, u64) {
+    let mut h: u64 = 0xcbf29ce484222325;
+    for byte in key {
+        h ^= *byte as u64;
+        h = h.wrapping_mul(0x100000001b3);
+    }
+
+    // splitmix64 finalizer for the second hash
+    let mut h2 = h.wrapping_add(0x9e3779b97f4a7c15);
+    h2 = (h2 ^ (h2 >> 30)).wrapping_mul(0xbf58476d1ce4e5b9);
+    h2 = (h2 ^ (h2 >> 27)).wrapping_mul(0x94d049bb133111eb);
+    h2 ^= h2 >> 31;
+    (h, h2 | 1)
+}
+
+/// Sets the bits of the key in the given bits of a filter
+#[inline]
+fn set_bits(bits: &mut [u64], num_bits: u64, num_hashes: u32, key: &[u8]) {
+    let (h1, h2) = hash(key);
+    for i in 0..num_hashes as u64 {
+        let i = index(h1, h2, i, num_bits);
+        bits[(i / 64) as usize] |= 1 << (i % 64);
+    }
+}
+
+#[inline]
+fn index(h1: u64, h2: u64, i: u64, num_bits: u64) -> u64 {
+    h1.wrapping_add(i.wrapping_mul(h2)) % num_bits
+}
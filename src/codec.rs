@@ -0,0 +1,149 @@
+use crate::macros::bytes_to_string;
+use pyo3::exceptions::{PyTypeError, PyValueError};
+use pyo3::prelude::*;
+use pyo3::types::{PyBool, PyDict, PyFloat, PyList, PyLong, PyString, PyTuple};
+use serde_json::{Map, Number, Value};
+
+/// The deepest nesting of lists and dicts that serde_json can read back.
+/// It also stops the recursion on values that contain themselves.
+const MAX_DEPTH: usize = 127;
+
+/// How values are converted to and from bytes by the mapping protocol of the store
+#[derive(Clone, Copy)]
+pub(crate) enum Codec {
+    /// Values are UTF-8 strings, as in `get` and `set`
+    Str,
+    /// Values are python objects made up of dicts, lists, tuples, strings, numbers, booleans
+    /// and None, saved as JSON
+    Json,
+}
+
+impl Codec {
+    /// Returns the codec of the given name
+    pub(crate) fn from_name(name: Option<&str>) -> PyResult<Self> {
+        match name {
+            None | Some("str") => Ok(Codec::Str),
+            Some("json") => Ok(Codec::Json),
+            Some(name) => Err(PyValueError::new_err(format!(
+                "unknown codec '{}', expected 'str' or 'json'",
+                name
+            ))),
+        }
+    }
+
+    /// Converts the python value into bytes
+    pub(crate) fn encode(&self, value: &PyAny) -> PyResult<Vec<u8>> {
+        match self {
+            Codec::Str => Ok(value.extract::<&str>()?.as_bytes().to_vec()),
+            Codec::Json => serde_json::to_vec(&to_json(value, 0)?)
+                .map_err(|e| PyValueError::new_err(e.to_string())),
+        }
+    }
+
+    /// Converts the bytes back into a python value
+    pub(crate) fn decode(&self, py: Python, bytes: Vec<u8>) -> PyResult<PyObject> {
+        match self {
+            Codec::Str => Ok(bytes_to_string!(bytes)?.into_py(py)),
+            Codec::Json => {
+                let value: Value = serde_json::from_slice(&bytes)
+                    .map_err(|e| PyValueError::new_err(e.to_string()))?;
+                Ok(from_json(py, value))
+            }
+        }
+    }
+}
+
+/// Converts a python object, found within `depth` lists and dicts, into a JSON value
+fn to_json(obj: &PyAny, depth: usize) -> PyResult<Value> {
+    if obj.is_none() {
+        return Ok(Value::Null);
+    }
+    // bool is checked before int since python's bool is a subclass of int
+    if let Ok(b) = obj.downcast::<PyBool>() {
+        return Ok(Value::Bool(b.is_true()));
+    }
+    if obj.downcast::<PyLong>().is_ok() {
+        if let Ok(i) = obj.extract::<i64>() {
+            return Ok(Value::from(i));
+        }
+        return match obj.extract::<u64>() {
+            Ok(u) => Ok(Value::from(u)),
+            Err(_) => Err(PyValueError::new_err("int too large to be saved as JSON")),
+        };
+    }
+    if let Ok(f) = obj.downcast::<PyFloat>() {
+        return Number::from_f64(f.value())
+            .map(Value::Number)
+            .ok_or_else(|| PyValueError::new_err("NaN and infinity cannot be saved as JSON"));
+    }
+    if let Ok(s) = obj.downcast::<PyString>() {
+        return Ok(Value::String(s.to_str()?.to_owned()));
+    }
+    let is_container = obj.downcast::<PyList>().is_ok()
+        || obj.downcast::<PyTuple>().is_ok()
+        || obj.downcast::<PyDict>().is_ok();
+    if is_container && depth >= MAX_DEPTH {
+        return Err(PyValueError::new_err(format!(
+            "lists and dicts nested more than {} levels deep, or containing themselves, cannot be saved as JSON",
+            MAX_DEPTH
+        )));
+    }
+    if let Ok(list) = obj.downcast::<PyList>() {
+        return list
+            .iter()
+            .map(|item| to_json(item, depth + 1))
+            .collect::<PyResult<Vec<_>>>()
+            .map(Value::Array);
+    }
+    if let Ok(tuple) = obj.downcast::<PyTuple>() {
+        return tuple
+            .iter()
+            .map(|item| to_json(item, depth + 1))
+            .collect::<PyResult<Vec<_>>>()
+            .map(Value::Array);
+    }
+    if let Ok(dict) = obj.downcast::<PyDict>() {
+        let mut map = Map::with_capacity(dict.len());
+        for (k, v) in dict.iter() {
+            let k = k
+                .downcast::<PyString>()
+                .map_err(|_| PyTypeError::new_err("keys of dicts saved as JSON must be str"))?;
+            map.insert(k.to_str()?.to_owned(), to_json(v, depth + 1)?);
+        }
+        return Ok(Value::Object(map));
+    }
+
+    Err(PyTypeError::new_err(format!(
+        "Object of type {} cannot be saved as JSON",
+        obj.get_type().name()?
+    )))
+}
+
+/// Converts a JSON value into a python object
+fn from_json(py: Python, value: Value) -> PyObject {
+    match value {
+        Value::Null => py.None(),
+        Value::Bool(b) => b.into_py(py),
+        Value::Number(n) => {
+            if let Some(i) = n.as_i64() {
+                i.into_py(py)
+            } else if let Some(u) = n.as_u64() {
+                u.into_py(py)
+            } else {
+                n.as_f64().unwrap_or(f64::NAN).into_py(py)
+            }
+        }
+        Value::String(s) => s.into_py(py),
+        Value::Array(items) => {
+            PyList::new(py, items.into_iter().map(|item| from_json(py, item))).into_py(py)
+        }
+        Value::Object(map) => {
+            let dict = PyDict::new(py);
+            for (k, v) in map {
+                // setting a str key on a new dict cannot fail
+                let _ = dict.set_item(k, from_json(py, v));
+            }
+            dict.into_py(py)
+        }
+    }
+}
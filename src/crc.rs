@@ -0,0 +1,36 @@
+/// The CRC-32 (IEEE) remainder of each byte
+const TABLE: [u32; 256] = table();
+
+const fn table() -> [u32; 256] {
+    let mut table = [0u32; 256];
+    let mut i = 0;
+    while i < 256 {
+        let mut crc = i as u32;
+        let mut j = 0;
+        while j < 8 {
+            crc = if crc & 1 != 0 {
+                (crc >> 1) ^ 0xedb88320
+            } else {
+                crc >> 1
+            };
+            j += 1;
+        }
+        table[i] = crc;
+        i += 1;
+    }
+    table
+}
+
+/// Returns the CRC-32 checksum of the given parts, as if they were a single slice.
+///
+/// It is hand-rolled, like the hash of the bloom filter, so as not to add a dependency
+/// for the files this package owns.
+pub(crate) fn crc32(parts: &[&[u8]]) -> u32 {
+    let mut crc = !0u32;
+    for part in parts {
+        for byte in *part {
+            crc = TABLE[((crc ^ *byte as u32) & 0xff) as usize] ^ (crc >> 8);
+        }
+    }
+    !crc
+}
@@ -1,9 +1,19 @@
 mod async_store;
+mod blob;
+mod bloom;
+mod codec;
+mod crc;
+mod lock;
 mod macros;
+mod pipeline;
 mod store;
+mod trace;
+mod verify;
 
 use crate::async_store::AsyncStore;
+use crate::pipeline::Pipeline;
 use crate::store::Store;
+use crate::verify::verify;
 use pyo3::prelude::*;
 
 /// A Python module implemented in Rust.
@@ -11,5 +21,7 @@ use pyo3::prelude::*;
 fn py_scdb(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_class::<Store>()?;
     m.add_class::<AsyncStore>()?;
+    m.add_class::<Pipeline>()?;
+    m.add_function(wrap_pyfunction!(verify, m)?)?;
     Ok(())
 }
@@ -0,0 +1,52 @@
+use std::fs::{self, File, OpenOptions};
+use std::io;
+use std::path::Path;
+
+/// The name of the lock file that open stores hold in the store directory
+const FILE_NAME: &str = "py_scdb.lock";
+
+/// A lock on a store directory, released when dropped.
+///
+/// Every open store holds it shared, so that `verify` can hold it exclusively
+/// to make sure that no store is using the files it repairs.
+pub(crate) struct StoreLock(File);
+
+impl StoreLock {
+    /// Locks the given store directory for an open store, creating the directory if need be
+    pub(crate) fn shared(store_path: &str) -> io::Result<Self> {
+        let file = open(store_path)?;
+        file.lock_shared()?;
+        Ok(Self(file))
+    }
+
+    /// Locks the given store directory for repairing it, or returns None if it does not exist.
+    ///
+    /// It fails if a store is open on the directory, in this or another process.
+    pub(crate) fn exclusive(store_path: &str) -> io::Result<Option<Self>> {
+        if !Path::new(store_path).exists() {
+            return Ok(None);
+        }
+
+        let file = open(store_path)?;
+        match file.try_lock() {
+            Ok(()) => Ok(Some(Self(file))),
+            Err(fs::TryLockError::WouldBlock) => Err(io::Error::new(
+                io::ErrorKind::WouldBlock,
+                format!(
+                    "the store at {} is open; close it before repairing it",
+                    store_path
+                ),
+            )),
+            Err(fs::TryLockError::Error(e)) => Err(e),
+        }
+    }
+}
+
+fn open(store_path: &str) -> io::Result<File> {
+    fs::create_dir_all(store_path)?;
+    OpenOptions::new()
+        .read(true)
+        .write(true)
+        .create(true)
+        .open(Path::new(store_path).join(FILE_NAME))
+}
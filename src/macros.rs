@@ -28,7 +28,17 @@ macro_rules! py_none {
     };
 }
 
+/// Marks the end of the given phase on a span, if the operation is being traced
+macro_rules! trace_phase {
+    ($span:expr, $phase:expr) => {
+        if let Some(span) = $span.as_mut() {
+            span.mark($phase);
+        }
+    };
+}
+
 pub(crate) use acquire_lock;
 pub(crate) use bytes_to_string;
 pub(crate) use io_to_py_result;
 pub(crate) use py_none;
+pub(crate) use trace_phase;
@@ -0,0 +1,152 @@
+use crate::async_store::{lock_blobs, may_contain};
+use crate::blob::{self, BlobStore};
+use crate::bloom::BloomFilter;
+use crate::macros::{acquire_lock, bytes_to_string, io_to_py_result, trace_phase};
+use crate::trace::{start_span, SharedTracer};
+use pyo3::prelude::*;
+use std::sync::{Arc, Mutex};
+
+/// An operation queued on a pipeline
+enum Op {
+    Set {
+        k: String,
+        v: String,
+        ttl: Option<u64>,
+    },
+    Get {
+        k: String,
+    },
+    Delete {
+        k: String,
+    },
+}
+
+#[pyclass]
+pub(crate) struct Pipeline {
+    db: Arc<Mutex<scdb::Store>>,
+    filter: Option<Arc<Mutex<BloomFilter>>>,
+    blobs: Option<Arc<Mutex<BlobStore>>>,
+    tracer: SharedTracer,
+    ops: Vec<Op>,
+}
+
+impl Pipeline {
+    /// Creates an empty pipeline for the given store
+    pub(crate) fn new(
+        db: Arc<Mutex<scdb::Store>>,
+        filter: Option<Arc<Mutex<BloomFilter>>>,
+        blobs: Option<Arc<Mutex<BlobStore>>>,
+        tracer: SharedTracer,
+    ) -> Self {
+        Self {
+            db,
+            filter,
+            blobs,
+            tracer,
+            ops: vec![],
+        }
+    }
+}
+
+#[pymethods]
+impl Pipeline {
+    /// Queues the setting of the given key value in the store
+    pub fn set(mut slf: PyRefMut<Self>, k: String, v: String, ttl: Option<u64>) -> PyRefMut<Self> {
+        slf.ops.push(Op::Set { k, v, ttl });
+        slf
+    }
+
+    /// Queues the getting of the value corresponding to the given key
+    pub fn get(mut slf: PyRefMut<Self>, k: String) -> PyRefMut<Self> {
+        slf.ops.push(Op::Get { k });
+        slf
+    }
+
+    /// Queues the deletion of the key-value for the given key
+    pub fn delete(mut slf: PyRefMut<Self>, k: String) -> PyRefMut<Self> {
+        slf.ops.push(Op::Delete { k });
+        slf
+    }
+
+    /// Returns the number of queued operations
+    pub fn __len__(&self) -> usize {
+        self.ops.len()
+    }
+
+    /// Runs all queued operations in order, under a single lock on the store,
+    /// returning a list of their results.
+    ///
+    /// The queue is emptied so the pipeline can be reused
+    pub fn execute<'a>(&mut self, py: Python<'a>) -> PyResult<&'a PyAny> {
+        let locals = pyo3_asyncio::async_std::get_current_locals(py)?;
+        let db = self.db.clone();
+        let mut span = start_span(&self.tracer, "pipeline");
+        let filter = self.filter.clone();
+        let blobs = self.blobs.clone();
+        let ops = std::mem::take(&mut self.ops);
+
+        pyo3_asyncio::async_std::future_into_py_with_locals(
+            py,
+            locals.clone(),
+            pyo3_asyncio::async_std::scope(locals, async move {
+                trace_phase!(span, "schedule");
+                let mut db = acquire_lock!(db)?;
+                let mut blobs = lock_blobs(&blobs)?;
+                trace_phase!(span, "lock");
+
+                let mut results: Vec<Option<String>> = Vec::with_capacity(ops.len());
+                for op in ops {
+                    let result = match op {
+                        Op::Set { k, v, ttl } => {
+                            if let Some(filter) = &filter {
+                                io_to_py_result!(acquire_lock!(filter)?.insert(k.as_bytes()))?;
+                            }
+                            trace_phase!(span, "filter");
+                            io_to_py_result!(blob::set(
+                                &mut db,
+                                blobs.as_deref_mut(),
+                                k.as_bytes(),
+                                v.as_bytes(),
+                                ttl
+                            ))?;
+                            trace_phase!(span, "db");
+                            None
+                        }
+                        Op::Get { k } => {
+                            let maybe_present = may_contain(&filter, k.as_bytes())?;
+                            trace_phase!(span, "filter");
+                            if maybe_present {
+                                let value = io_to_py_result!(blob::get(
+                                    &mut db,
+                                    blobs.as_deref_mut(),
+                                    k.as_bytes()
+                                ))?;
+                                trace_phase!(span, "db");
+                                let value = match value {
+                                    None => None,
+                                    Some(v) => Some(bytes_to_string!(v)?),
+                                };
+                                trace_phase!(span, "decode");
+                                value
+                            } else {
+                                None
+                            }
+                        }
+                        Op::Delete { k } => {
+                            let maybe_present = may_contain(&filter, k.as_bytes())?;
+                            trace_phase!(span, "filter");
+                            if maybe_present {
+                                io_to_py_result!(db.delete(k.as_bytes()))?;
+                                trace_phase!(span, "db");
+                            }
+                            None
+                        }
+                    };
+                    results.push(result);
+                }
+
+                Ok::<Vec<Option<String>>, PyErr>(results)
+            }),
+        )
+    }
+}
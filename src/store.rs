@@ -1,9 +1,33 @@
-use crate::macros::{bytes_to_string, io_to_py_result};
+use crate::blob::{self, BlobStore};
+use crate::bloom::{self, BloomFilter};
+use crate::codec::Codec;
+use crate::lock::StoreLock;
+use crate::macros::{acquire_lock, bytes_to_string, io_to_py_result, trace_phase};
+use crate::trace::{start_span, SharedTracer, Span};
+use pyo3::exceptions::{PyKeyError, PyTypeError};
 use pyo3::prelude::*;
+use pyo3::types::{PyIterator, PyList};
+use std::collections::HashMap;
+use std::sync::{Arc, Mutex};
 
-#[pyclass(subclass)]
+#[pyclass(subclass, mapping)]
 pub(crate) struct Store {
+    state: Mutex<State>,
+    tracer: SharedTracer,
+    codec: Codec,
+    /// Whether the keys can be listed, for `len()` and iteration
+    is_search_enabled: bool,
+    /// The counts of lookups of the bloom filter, kept out of `state` so as to be read without waiting
+    filter_stats: Option<Arc<bloom::Stats>>,
+    /// Keeps `verify` from repairing the files while the store is open
+    _lock: StoreLock,
+}
+
+/// The parts of the store that only one thread can use at a time
+struct State {
     db: scdb::Store,
+    filter: Option<BloomFilter>,
+    blobs: Option<BlobStore>,
 }
 
 #[pymethods]
@@ -15,7 +39,10 @@ impl Store {
         redundant_blocks = "None",
         pool_capacity = "None",
         compaction_interval = "None",
-        is_search_enabled = "false"
+        is_search_enabled = "false",
+        bloom_filter_fp_rate = "None",
+        blob_threshold = "None",
+        codec = "None"
     )]
     #[new]
     pub fn new(
@@ -25,7 +52,25 @@ impl Store {
         pool_capacity: Option<usize>,
         compaction_interval: Option<u32>,
         is_search_enabled: bool,
+        bloom_filter_fp_rate: Option<f64>,
+        blob_threshold: Option<usize>,
+        codec: Option<&str>,
     ) -> PyResult<Self> {
+        let codec = Codec::from_name(codec)?;
+        let lock = io_to_py_result!(StoreLock::shared(store_path))?;
+        let filter = match bloom_filter_fp_rate {
+            None => {
+                io_to_py_result!(BloomFilter::invalidate(store_path))?;
+                None
+            }
+            Some(rate) => Some(io_to_py_result!(BloomFilter::open(
+                store_path,
+                max_keys,
+                rate,
+                is_search_enabled
+            ))?),
+        };
+        let blobs = io_to_py_result!(BlobStore::open(store_path, blob_threshold))?;
         let db = io_to_py_result!(scdb::Store::new(
             store_path,
             max_keys,
@@ -34,54 +79,324 @@ impl Store {
             compaction_interval,
             is_search_enabled,
         ))?;
-        Ok(Self { db })
+        Ok(Self {
+            filter_stats: filter.as_ref().map(BloomFilter::stats),
+            state: Mutex::new(State { db, filter, blobs }),
+            tracer: SharedTracer::default(),
+            codec,
+            is_search_enabled,
+            _lock: lock,
+        })
     }
 
     /// Sets the given key value in the store
     ///
     /// This is used to insert or update any key-value pair in the store
-    pub fn set(&mut self, k: &str, v: &str, ttl: Option<u64>) -> PyResult<()> {
-        io_to_py_result!(self.db.set(k.as_bytes(), v.as_bytes(), ttl))
+    pub fn set(&self, py: Python, k: &str, v: &str, ttl: Option<u64>) -> PyResult<()> {
+        let mut span = start_span(&self.tracer, "set");
+        self.set_bytes(py, k, v.as_bytes(), ttl, &mut span)
     }
 
     /// Returns the value corresponding to the given key
-    pub fn get(&mut self, py: Python, k: &str) -> PyResult<Py<PyAny>> {
-        let value = io_to_py_result!(self.db.get(k.as_bytes()))?;
-        match value {
-            None => Ok(py.None()),
+    pub fn get(&self, py: Python, k: &str) -> PyResult<Py<PyAny>> {
+        let mut span = start_span(&self.tracer, "get");
+        let value = self.get_bytes(py, k, &mut span)?;
+
+        let value = match value {
+            None => py.None(),
             Some(v) => {
                 let v = bytes_to_string!(v)?;
-                Ok(v.into_py(py))
+                v.into_py(py)
             }
-        }
+        };
+        trace_phase!(span, "decode");
+        Ok(value)
+    }
+
+    /// Checks whether the given key exists in the store without decoding its value
+    pub fn contains(&self, py: Python, k: &str) -> PyResult<bool> {
+        let mut span = start_span(&self.tracer, "contains");
+        py.allow_threads(|| -> PyResult<bool> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            state.contains(k, &mut span)
+        })
+    }
+
+    /// Checks whether each of the given keys exists in the store, in the order given
+    pub fn contains_many(&self, py: Python, keys: Vec<&str>) -> PyResult<Vec<bool>> {
+        let mut span = start_span(&self.tracer, "contains_many");
+        py.allow_threads(|| -> PyResult<Vec<bool>> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            keys.into_iter()
+                .map(|k| state.contains(k, &mut span))
+                .collect()
+        })
+    }
+
+    /// Counts the key-values whose key start with the given `prefix`
+    /// without converting them into python strings
+    pub fn count(&self, py: Python, prefix: &str) -> PyResult<usize> {
+        let mut span = start_span(&self.tracer, "count");
+        py.allow_threads(|| -> PyResult<usize> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            let res = io_to_py_result!(state.db.search(prefix.as_bytes(), 0, 0))?;
+            trace_phase!(span, "db");
+            Ok(res.len())
+        })
     }
 
     /// Searches for key-values whose key start with the given `term`.
     ///
     /// In order to do pagination, we use `skip` to skip the first `skip` records
     /// and `limit` to return not more than the given number of items
-    pub fn search(&mut self, term: &str, skip: u64, limit: u64) -> PyResult<Vec<(String, String)>> {
-        let res = self.db.search(term.as_bytes(), skip, limit);
-        let res: Vec<(Vec<u8>, Vec<u8>)> = io_to_py_result!(res)?;
-        res.into_iter().map(|(k, v)| {
+    pub fn search(&self, py: Python, term: &str, skip: u64, limit: u64) -> PyResult<Vec<(String, String)>> {
+        let mut span = start_span(&self.tracer, "search");
+        let res = py.allow_threads(|| -> PyResult<Vec<(Vec<u8>, Vec<u8>)>> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            let state = &mut *state;
+            let res = io_to_py_result!(blob::search(
+                &mut state.db,
+                state.blobs.as_mut(),
+                term.as_bytes(),
+                skip,
+                limit
+            ));
+            trace_phase!(span, "db");
+            res
+        })?;
+
+        let res: PyResult<Vec<(String, String)>> = res.into_iter().map(|(k, v)| {
             let k = bytes_to_string!(k)?;
             let v = bytes_to_string!(v)?;
             Ok((k, v))
-        }).collect()
+        }).collect();
+        trace_phase!(span, "decode");
+        res
     }
 
     /// Deletes the key-value for the given key
-    pub fn delete(&mut self, k: &str) -> PyResult<()> {
-        io_to_py_result!(self.db.delete(k.as_bytes()))
+    pub fn delete(&self, py: Python, k: &str) -> PyResult<()> {
+        let mut span = start_span(&self.tracer, "delete");
+        py.allow_threads(|| -> PyResult<()> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            let maybe_present = state.may_contain(k);
+            trace_phase!(span, "filter");
+            if !maybe_present {
+                return Ok(());
+            }
+            let res = io_to_py_result!(state.db.delete(k.as_bytes()));
+            trace_phase!(span, "db");
+            res
+        })
     }
 
     /// Clears all data in the store
-    pub fn clear(&mut self) -> PyResult<()> {
-        io_to_py_result!(self.db.clear())
+    pub fn clear(&self, py: Python) -> PyResult<()> {
+        let mut span = start_span(&self.tracer, "clear");
+        py.allow_threads(|| -> PyResult<()> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            let state = &mut *state;
+            io_to_py_result!(blob::clear(&mut state.db, state.blobs.as_mut()))?;
+            trace_phase!(span, "db");
+            if let Some(filter) = state.filter.as_mut() {
+                filter.clear();
+            }
+            trace_phase!(span, "filter");
+            Ok(())
+        })
     }
 
     /// Manually removes dangling key-value pairs in the database file. Like vacuuming.
-    pub fn compact(&mut self) -> PyResult<()> {
-        io_to_py_result!(self.db.compact())
+    pub fn compact(&self, py: Python) -> PyResult<()> {
+        let mut span = start_span(&self.tracer, "compact");
+        py.allow_threads(|| -> PyResult<()> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            let state = &mut *state;
+            io_to_py_result!(blob::compact(&mut state.db, state.blobs.as_mut()))?;
+            trace_phase!(span, "db");
+            if let Some(filter) = state.filter.as_mut() {
+                io_to_py_result!(filter.compact(&mut state.db))?;
+            }
+            trace_phase!(span, "filter");
+            Ok(())
+        })
+    }
+
+    /// Persists the bloom filter, if any, so that it is trusted on the next start
+    /// even if the process is killed before the store is closed
+    pub fn flush(&self, py: Python) -> PyResult<()> {
+        py.allow_threads(|| -> PyResult<()> {
+            let mut state = acquire_lock!(self.state)?;
+            match state.filter.as_mut() {
+                None => Ok(()),
+                Some(filter) => io_to_py_result!(filter.persist()),
+            }
+        })
+    }
+
+    /// Returns the value for the given key, decoded with the store's codec,
+    /// raising a KeyError if the key is not in the store
+    pub fn __getitem__(&self, py: Python, k: &str) -> PyResult<PyObject> {
+        let mut span = start_span(&self.tracer, "getitem");
+        let value = match self.get_bytes(py, k, &mut span)? {
+            None => return Err(PyKeyError::new_err(k.to_owned())),
+            Some(v) => self.codec.decode(py, v)?,
+        };
+        trace_phase!(span, "decode");
+        Ok(value)
+    }
+
+    /// Sets the given key to the value encoded with the store's codec
+    pub fn __setitem__(&self, py: Python, k: &str, v: &PyAny) -> PyResult<()> {
+        let mut span = start_span(&self.tracer, "setitem");
+        let v = self.codec.encode(v)?;
+        trace_phase!(span, "encode");
+        self.set_bytes(py, k, &v, None, &mut span)
+    }
+
+    /// Deletes the key-value for the given key, raising a KeyError if the key is not in the store
+    pub fn __delitem__(&self, py: Python, k: &str) -> PyResult<()> {
+        let mut span = start_span(&self.tracer, "delitem");
+        py.allow_threads(|| -> PyResult<()> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            if !state.contains(k, &mut span)? {
+                return Err(PyKeyError::new_err(k.to_owned()));
+            }
+            let res = io_to_py_result!(state.db.delete(k.as_bytes()));
+            trace_phase!(span, "db");
+            res
+        })
+    }
+
+    /// Checks whether the given key exists in the store, for the `in` operator
+    pub fn __contains__(&self, py: Python, k: &str) -> PyResult<bool> {
+        self.contains(py, k)
+    }
+
+    /// Returns the number of keys in the store, raising a TypeError if search is not enabled
+    pub fn __len__(&self, py: Python) -> PyResult<usize> {
+        self.check_can_list_keys()?;
+        let mut span = start_span(&self.tracer, "len");
+        py.allow_threads(|| -> PyResult<usize> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            let mut len = 0;
+            let res = io_to_py_result!(bloom::for_each_key(&mut state.db, |_| len += 1));
+            trace_phase!(span, "db");
+            res.map(|_| len)
+        })
+    }
+
+    /// Returns an iterator over the keys in the store at the time of the call,
+    /// raising a TypeError if search is not enabled
+    pub fn __iter__<'py>(&self, py: Python<'py>) -> PyResult<&'py PyIterator> {
+        self.check_can_list_keys()?;
+        let mut span = start_span(&self.tracer, "iter");
+        let keys = py.allow_threads(|| -> PyResult<Vec<Vec<u8>>> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            let mut keys = vec![];
+            let res = io_to_py_result!(bloom::for_each_key(&mut state.db, |k| keys.push(k)));
+            trace_phase!(span, "db");
+            res.map(|_| keys)
+        })?;
+
+        let keys: PyResult<Vec<String>> = keys.into_iter().map(|k| bytes_to_string!(k)).collect();
+        let keys = PyList::new(py, keys?);
+        trace_phase!(span, "decode");
+        PyIterator::from_object(py, keys)
+    }
+
+    /// Sets the callback to be called with the per-phase timings of a sample of operations.
+    ///
+    /// Passing None disables tracing. It can be called while other threads are using the store
+    #[args(callback, sample_rate = "1.0")]
+    pub fn set_trace_callback(&self, callback: Option<PyObject>, sample_rate: f64) -> PyResult<()> {
+        self.tracer.set(callback, sample_rate)
+    }
+
+    /// Returns the number of lookups made against the bloom filter and how many of them
+    /// were answered without touching the database file, or None if the filter is disabled
+    pub fn bloom_filter_stats(&self) -> Option<HashMap<&'static str, u64>> {
+        self.filter_stats.as_ref().map(|stats| {
+            let (lookups, short_circuits) = stats.get();
+            HashMap::from([("lookups", lookups), ("short_circuits", short_circuits)])
+        })
+    }
+}
+
+impl Store {
+    /// Raises a TypeError unless the store was opened with search enabled,
+    /// since scdb cannot otherwise list its keys
+    fn check_can_list_keys(&self) -> PyResult<()> {
+        if self.is_search_enabled {
+            Ok(())
+        } else {
+            Err(PyTypeError::new_err(
+                "the keys of a store can only be listed if it is opened with is_search_enabled=True",
+            ))
+        }
+    }
+
+    /// Saves the given value bytes under the given key, releasing the GIL while waiting on the lock
+    fn set_bytes(&self, py: Python, k: &str, v: &[u8], ttl: Option<u64>, span: &mut Option<Span>) -> PyResult<()> {
+        py.allow_threads(|| -> PyResult<()> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            if let Some(filter) = state.filter.as_mut() {
+                io_to_py_result!(filter.insert(k.as_bytes()))?;
+            }
+            trace_phase!(span, "filter");
+            let state = &mut *state;
+            let res = io_to_py_result!(blob::set(&mut state.db, state.blobs.as_mut(), k.as_bytes(), v, ttl));
+            trace_phase!(span, "db");
+            res
+        })
+    }
+
+    /// Returns the raw value bytes for the given key, releasing the GIL while waiting on the lock
+    fn get_bytes(&self, py: Python, k: &str, span: &mut Option<Span>) -> PyResult<Option<Vec<u8>>> {
+        py.allow_threads(|| -> PyResult<Option<Vec<u8>>> {
+            let mut state = acquire_lock!(self.state)?;
+            trace_phase!(span, "lock");
+            let maybe_present = state.may_contain(k);
+            trace_phase!(span, "filter");
+            if !maybe_present {
+                return Ok(None);
+            }
+            let state = &mut *state;
+            let value = io_to_py_result!(blob::get(&mut state.db, state.blobs.as_mut(), k.as_bytes()));
+            trace_phase!(span, "db");
+            value
+        })
+    }
+}
+
+impl State {
+    /// Returns false if the bloom filter is sure the key is not in the store
+    fn may_contain(&mut self, k: &str) -> bool {
+        self.filter
+            .as_mut()
+            .map_or(true, |filter| filter.may_contain(k.as_bytes()))
+    }
+
+    /// Checks whether the given key exists, recording the phases on the given span
+    fn contains(&mut self, k: &str, span: &mut Option<Span>) -> PyResult<bool> {
+        let maybe_present = self.may_contain(k);
+        trace_phase!(span, "filter");
+        if !maybe_present {
+            return Ok(false);
+        }
+        let value = io_to_py_result!(self.db.get(k.as_bytes()))?;
+        trace_phase!(span, "db");
+        Ok(value.is_some())
     }
 }
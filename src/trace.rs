@@ -0,0 +1,124 @@
+use pyo3::prelude::*;
+use pyo3::types::PyDict;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, RwLock};
+use std::time::Instant;
+
+/// Calls a python callback with the per-phase timings of a sample of the store's operations
+pub(crate) struct Tracer {
+    callback: PyObject,
+    /// Every `interval`-th operation is traced
+    interval: u64,
+    counter: AtomicU64,
+}
+
+impl Tracer {
+    /// Creates a tracer that samples roughly `sample_rate` of all operations
+    pub(crate) fn new(callback: PyObject, sample_rate: f64) -> PyResult<Self> {
+        if !(sample_rate > 0.0 && sample_rate <= 1.0) {
+            return Err(pyo3::exceptions::PyValueError::new_err(
+                "sample_rate should be greater than 0 and not more than 1",
+            ));
+        }
+
+        Ok(Self {
+            callback,
+            interval: (1.0 / sample_rate).round() as u64,
+            counter: AtomicU64::new(0),
+        })
+    }
+
+    /// Returns a span for the given operation if it is to be sampled
+    fn sample(self: &Arc<Self>, op: &'static str) -> Option<Span> {
+        if self.counter.fetch_add(1, Ordering::Relaxed) % self.interval != 0 {
+            return None;
+        }
+
+        let now = Instant::now();
+        Some(Span {
+            tracer: self.clone(),
+            op,
+            start: now,
+            last: now,
+            phases: Vec::with_capacity(4),
+        })
+    }
+}
+
+/// The timings of a single sampled operation.
+///
+/// When dropped, the tracer's callback is called with the name of the operation
+/// and a dict of phase name to duration in seconds, including the `total`.
+pub(crate) struct Span {
+    tracer: Arc<Tracer>,
+    op: &'static str,
+    start: Instant,
+    last: Instant,
+    phases: Vec<(&'static str, f64)>,
+}
+
+impl Span {
+    /// Records the time elapsed since the last mark as part of the given phase
+    pub(crate) fn mark(&mut self, phase: &'static str) {
+        let now = Instant::now();
+        let elapsed = now.duration_since(self.last).as_secs_f64();
+        self.last = now;
+
+        match self.phases.iter_mut().find(|(name, _)| *name == phase) {
+            Some((_, total)) => *total += elapsed,
+            None => self.phases.push((phase, elapsed)),
+        }
+    }
+}
+
+impl Drop for Span {
+    fn drop(&mut self) {
+        let total = self.start.elapsed().as_secs_f64();
+        Python::with_gil(|py| {
+            let timings = PyDict::new(py);
+            let res = self
+                .phases
+                .iter()
+                .try_for_each(|(phase, elapsed)| timings.set_item(*phase, *elapsed))
+                .and_then(|_| timings.set_item("total", total))
+                .and_then(|_| self.tracer.callback.call1(py, (self.op, timings)));
+
+            // errors cannot be raised from here, so they are printed like python does
+            // for exceptions in callbacks it calls on its own
+            if let Err(e) = res {
+                e.print(py);
+            }
+        });
+    }
+}
+
+/// The tracer of a store, which can be replaced while other threads or tasks are using the store.
+///
+/// Clones share the same tracer. Operations that already started keep the tracer they started with.
+#[derive(Clone, Default)]
+pub(crate) struct SharedTracer(Arc<RwLock<Option<Arc<Tracer>>>>);
+
+impl SharedTracer {
+    /// Replaces the tracer with one calling the given callback, or disables tracing if it is None
+    pub(crate) fn set(&self, callback: Option<PyObject>, sample_rate: f64) -> PyResult<()> {
+        let tracer = match callback {
+            None => None,
+            Some(callback) => Some(Arc::new(Tracer::new(callback, sample_rate)?)),
+        };
+        *self
+            .0
+            .write()
+            .map_err(|e| pyo3::exceptions::PyBaseException::new_err(e.to_string()))? = tracer;
+        Ok(())
+    }
+}
+
+/// Starts a span for the given operation if tracing is enabled and the operation is sampled
+#[inline]
+pub(crate) fn start_span(tracer: &SharedTracer, op: &'static str) -> Option<Span> {
+    match tracer.0.read() {
+        Ok(tracer) => tracer.as_ref().and_then(|tracer| tracer.sample(op)),
+        // a panic while replacing the tracer only disables tracing
+        Err(_) => None,
+    }
+}
@@ -0,0 +1,24 @@
+use crate::blob;
+use crate::bloom;
+use crate::lock::StoreLock;
+use crate::macros::io_to_py_result;
+use pyo3::prelude::*;
+
+/// Checks the files that py_scdb keeps next to `dump.scdb` i.e. the bloom filter and the
+/// segment files of large values, returning the problems found.
+///
+/// If `repair` is true, the problems are fixed by dropping the bad data, which fails
+/// if a store is open on `store_path`. `dump.scdb` itself is owned, and recovered, by scdb.
+#[pyfunction(store_path, repair = "false")]
+pub(crate) fn verify(py: Python, store_path: &str, repair: bool) -> PyResult<Vec<String>> {
+    py.allow_threads(|| -> PyResult<Vec<String>> {
+        let _lock = if repair {
+            io_to_py_result!(StoreLock::exclusive(store_path))?
+        } else {
+            None
+        };
+        let mut problems = io_to_py_result!(bloom::verify(store_path, repair))?;
+        problems.extend(io_to_py_result!(blob::verify(store_path, repair))?);
+        Ok(problems)
+    })
+}
@@ -33,6 +33,9 @@ search_records = [
 
 store_fixture = [lazy_fixture("sync_store")]
 searchable_store_fixture = [lazy_fixture("sync_searchable_store")]
+bloom_store_fixture = [lazy_fixture("sync_bloom_store")]
+blob_store_fixture = [lazy_fixture("sync_blob_store")]
+json_store_fixture = [lazy_fixture("sync_json_store")]
 records_fixture = [(lazy_fixture("sync_store"), k, v) for (k, v) in records[:2]]
 searchable_records_fixture = [
     (lazy_fixture("sync_searchable_store"), k, v) for (k, v) in records[:2]
@@ -59,6 +62,7 @@ search_terms_fixture = [
 
 async_store_fixture = [lazy_fixture("async_store")]
 async_searchable_store_fixture = [lazy_fixture("async_searchable_store")]
+async_bloom_store_fixture = [lazy_fixture("async_bloom_store")]
 
 
 @pytest.fixture()
@@ -77,6 +81,33 @@ def sync_searchable_store():
     _store.clear()
 
 
+@pytest.fixture()
+def sync_bloom_store():
+    """The key-value store with a bloom filter in front of its index"""
+    _store = Store(store_path=store_path, bloom_filter_fp_rate=0.01)
+    # a bloom filter is only trusted for stores it has seen from empty
+    _store.clear()
+    yield _store
+    _store.clear()
+
+
+@pytest.fixture()
+def sync_blob_store():
+    """The key-value store that keeps values of 64 bytes or more out of line"""
+    _store = Store(store_path=store_path, is_search_enabled=True, blob_threshold=64)
+    _store.clear()
+    yield _store
+    _store.clear()
+
+
+@pytest.fixture()
+def sync_json_store():
+    """The key-value store whose mapping protocol saves values as JSON"""
+    _store = Store(store_path=store_path, codec="json")
+    yield _store
+    _store.clear()
+
+
 @pytest_asyncio.fixture
 async def async_store():
     """The asynchronous key-value store"""
@@ -91,3 +122,13 @@ async def async_searchable_store():
     _store = AsyncStore(store_path=async_store_path, is_search_enabled=True)
     yield _store
     await _store.clear()
+
+
+@pytest_asyncio.fixture
+async def async_bloom_store():
+    """The asynchronous key-value store with a bloom filter in front of its index"""
+    _store = AsyncStore(store_path=async_store_path, bloom_filter_fp_rate=0.01)
+    # a bloom filter is only trusted for stores it has seen from empty
+    await _store.clear()
+    yield _store
+    await _store.clear()
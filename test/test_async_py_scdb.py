@@ -6,11 +6,12 @@ import pytest
 from py_scdb import AsyncStore
 from test.conftest import (
     async_store_fixture,
+    async_bloom_store_fixture,
     records,
     search_records,
     async_searchable_store_fixture,
 )
-from test.utils import fill_async_store, get_async_db_file_size
+from test.utils import fill_async_store, get_async_db_file_size, async_store_path
 
 
 @pytest.mark.asyncio
@@ -263,6 +264,55 @@ async def test_search_after_clear(store: AsyncStore):
         assert (await store.search(term=term, skip=0, limit=0)) == []
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", async_store_fixture)
+async def test_contains(store: AsyncStore):
+    """Returns True for existing keys and False for missing, deleted or expired ones"""
+    await fill_async_store(store=store, data=records[:3])
+    await fill_async_store(store=store, data=records[3:5], ttl=1)
+    await store.delete(k=records[0][0])
+    time.sleep(2)
+
+    assert (await store.contains(k=records[0][0])) is False
+    for (k, _) in records[1:3]:
+        assert (await store.contains(k=k)) is True
+    for (k, _) in records[3:]:
+        assert (await store.contains(k=k)) is False
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", async_store_fixture)
+async def test_contains_many(store: AsyncStore):
+    """Returns a boolean for each key, in the order given"""
+    await fill_async_store(store=store, data=records[:3])
+    keys = [k for (k, _) in records]
+    expected = [True] * 3 + [False] * (len(keys) - 3)
+    assert (await store.contains_many(keys=keys)) == expected
+    assert (await store.contains_many(keys=[])) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", async_searchable_store_fixture)
+async def test_count(store: AsyncStore):
+    """Returns the number of key-values whose keys start with the given prefix"""
+    test_data = [
+        ("f", 3),
+        ("fo", 3),
+        ("foo", 2),
+        ("food", 1),
+        ("b", 2),
+        ("bar", 1),
+        ("p", 0),
+        ("pigg", 0),
+        ("bare", 0),
+    ]
+
+    await fill_async_store(store=store, data=search_records)
+    await store.delete(k="pig")
+    for (term, expected) in test_data:
+        assert (await store.count(prefix=term)) == expected
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("store", async_store_fixture)
 async def test_delete_existing_key(store: AsyncStore):
@@ -320,3 +370,135 @@ async def test_compact(store: AsyncStore):
     # the rest are available
     for (k, v) in records[4:]:
         assert (await store.get(k=k)) == v
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", async_bloom_store_fixture)
+async def test_bloom_filter(store: AsyncStore):
+    """Short-circuits lookups of keys that were never set, without changing results"""
+    await fill_async_store(store=store, data=records[:3])
+    await store.delete(k=records[0][0])
+
+    for (k, v) in records[1:3]:
+        assert (await store.get(k=k)) == v
+        assert (await store.contains(k=k)) is True
+    for (k, _) in records[3:]:
+        assert (await store.get(k=k)) is None
+    assert (await store.get(k=records[0][0])) is None
+    keys = [k for (k, _) in records[3:]]
+    assert (await store.contains_many(keys=keys)) == [False] * 4
+
+    stats = store.bloom_filter_stats()
+    assert stats["lookups"] == 14
+    assert 0 < stats["short_circuits"] <= 8
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", async_bloom_store_fixture)
+async def test_bloom_filter_after_clear(store: AsyncStore):
+    """Forgets all keys when the store is cleared"""
+    await fill_async_store(store=store, data=records)
+    await store.clear()
+    await fill_async_store(store=store, data=records[:1])
+
+    assert (await store.get(k=records[0][0])) == records[0][1]
+    for (k, _) in records[1:]:
+        assert (await store.get(k=k)) is None
+
+
+@pytest.mark.asyncio
+async def test_bloom_filter_rebuilt_on_compact():
+    """Rebuilds an untrusted bloom filter from the keys in the store when search is enabled"""
+    store = AsyncStore(store_path=async_store_path, is_search_enabled=True)
+    await store.clear()
+    await fill_async_store(store=store, data=records[:4])
+    await store.delete(k=records[0][0])
+    del store
+
+    store = AsyncStore(
+        store_path=async_store_path, is_search_enabled=True, bloom_filter_fp_rate=0.01
+    )
+    try:
+        assert (await store.get(k=records[4][0])) is None
+        assert store.bloom_filter_stats()["lookups"] == 0
+
+        await store.compact()
+        for (k, v) in records[1:4]:
+            assert (await store.get(k=k)) == v
+        for (k, _) in records[:1] + records[4:]:
+            assert (await store.get(k=k)) is None
+        assert store.bloom_filter_stats()["short_circuits"] > 0
+    finally:
+        await store.clear()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", async_store_fixture)
+async def test_set_trace_callback(store: AsyncStore):
+    """Calls the trace callback with the per-phase timings of each operation"""
+    traces = []
+    store.set_trace_callback(lambda op, timings: traces.append((op, timings)))
+
+    await store.set(k="foo", v="bar")
+    await store.get(k="foo")
+    store.set_trace_callback(None)
+    await store.get(k="foo")
+
+    assert [op for (op, _) in traces] == ["set", "get"]
+    assert set(traces[1][1].keys()) == {
+        "schedule",
+        "lock",
+        "filter",
+        "db",
+        "decode",
+        "total",
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", async_store_fixture)
+async def test_pipeline(store: AsyncStore):
+    """Runs the queued operations in order and returns their results"""
+    await fill_async_store(store=store, data=records[:2])
+    (k0, v0), (k1, v1), (k2, v2) = records[:3]
+
+    pipeline = store.pipeline()
+    pipeline.get(k0).set(k2, v2).get(k2).delete(k0).get(k0).get(k1)
+    assert len(pipeline) == 6
+
+    results = await pipeline.execute()
+
+    assert results == [v0, None, v2, None, None, v1]
+    assert len(pipeline) == 0
+    assert (await store.get(k=k0)) is None
+    assert (await store.get(k=k2)) == v2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", async_store_fixture)
+async def test_pipeline_with_ttl(store: AsyncStore):
+    """Sets key-values with a ttl"""
+    ttl = 1
+    pipeline = store.pipeline()
+    for (k, v) in records[:3]:
+        pipeline.set(k, v)
+    for (k, v) in records[3:]:
+        pipeline.set(k, v, ttl)
+    await pipeline.execute()
+
+    time.sleep(ttl * 2)
+
+    for (k, v) in records[:3]:
+        pipeline.get(k)
+    for (k, v) in records[3:]:
+        pipeline.get(k)
+    assert (await pipeline.execute()) == [v for (_, v) in records[:3]] + [None] * (
+        len(records) - 3
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", async_store_fixture)
+async def test_empty_pipeline(store: AsyncStore):
+    """Returns an empty list if no operations were queued"""
+    assert (await store.pipeline().execute()) == []
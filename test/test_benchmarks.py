@@ -1,4 +1,6 @@
 """Benchmark tests for Store"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 
@@ -7,6 +9,8 @@ from test.conftest import (
     keys_fixture,
     records,
     store_fixture,
+    bloom_store_fixture,
+    json_store_fixture,
     search_records,
     search_terms_fixture,
     searchable_records_fixture,
@@ -35,6 +39,50 @@ def test_benchmark_get(benchmark, store, k):
     benchmark(store.get, k=k)
 
 
+@pytest.mark.parametrize("threads", [1, 2, 4, 8])
+@pytest.mark.parametrize("store", store_fixture)
+def test_benchmark_threaded_get(benchmark, store, threads):
+    """Benchmarks 1000 get operations shared among a number of threads"""
+    fill_store(store=store, data=records)
+    keys = [k for (k, _) in records] * (1000 // len(records))
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+
+        def get_all():
+            return list(executor.map(lambda k: store.get(k=k), keys))
+
+        benchmark(get_all)
+
+
+@pytest.mark.parametrize("store", store_fixture + bloom_store_fixture)
+def test_benchmark_threaded_reads_with_cpu_bound_thread(benchmark, store):
+    """Benchmarks 1000 get and contains operations shared among 4 threads while another
+    thread runs pure Python code, recording how far that thread got in `extra_info`"""
+    fill_store(store=store, data=records)
+    keys = [k for (k, _) in records] * (500 // len(records))
+    stop = threading.Event()
+    spins = [0]
+
+    def spin():
+        while not stop.is_set():
+            spins[0] += 1
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+
+        def read_all():
+            list(executor.map(lambda k: store.get(k=k), keys))
+            list(executor.map(lambda k: store.contains(k=k), keys))
+
+        spinner = threading.Thread(target=spin)
+        spinner.start()
+        try:
+            benchmark(read_all)
+        finally:
+            stop.set()
+            spinner.join()
+        benchmark.extra_info["cpu_bound_spins"] = spins[0]
+
+
 @pytest.mark.parametrize("store, k", searchable_keys_fixture)
 def test_benchmark_get_with_search(benchmark, store, k):
     """Benchmarks the get operation when search is enabled"""
@@ -42,6 +90,40 @@ def test_benchmark_get_with_search(benchmark, store, k):
     benchmark(store.get, k=k)
 
 
+@pytest.mark.parametrize("store, k", keys_fixture)
+def test_benchmark_contains(benchmark, store, k):
+    """Benchmarks the contains operation"""
+    fill_store(store=store, data=records)
+    benchmark(store.contains, k=k)
+
+
+@pytest.mark.parametrize("store, term", search_terms_fixture)
+def test_benchmark_count(benchmark, store, term):
+    """Benchmarks the count operation"""
+    fill_store(store=store, data=search_records)
+    benchmark(store.count, prefix=term)
+
+
+@pytest.mark.parametrize("store", bloom_store_fixture)
+def test_benchmark_get_missing_with_bloom_filter(benchmark, store):
+    """Benchmarks the get operation for missing keys when the bloom filter is enabled"""
+    fill_store(store=store, data=records)
+    benchmark(store.get, k="some-random-key")
+
+
+@pytest.mark.parametrize("store", json_store_fixture)
+def test_benchmark_setitem_with_json_codec(benchmark, store):
+    """Benchmarks store[k] = v for a dict when the json codec is enabled"""
+    benchmark(store.__setitem__, "foo", {"a": 1, "b": [1.5, "two", None]})
+
+
+@pytest.mark.parametrize("store", json_store_fixture)
+def test_benchmark_getitem_with_json_codec(benchmark, store):
+    """Benchmarks store[k] for a dict when the json codec is enabled"""
+    store["foo"] = {"a": 1, "b": [1.5, "two", None]}
+    benchmark(store.__getitem__, "foo")
+
+
 @pytest.mark.parametrize("store, term", search_terms_fixture)
 def test_benchmark_search(benchmark, store, term):
     """Benchmarks the get operation"""
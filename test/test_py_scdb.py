@@ -1,17 +1,31 @@
 """Tests for Store"""
 
+import os
+import struct
+import subprocess
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 
-from py_scdb import Store
+from py_scdb import Store, verify
 from test.conftest import (
     store_fixture,
+    bloom_store_fixture,
+    blob_store_fixture,
+    json_store_fixture,
     records,
     search_records,
     searchable_store_fixture,
 )
-from test.utils import fill_store, get_db_file_size
+from test.utils import (
+    fill_store,
+    get_db_file_size,
+    get_blobs_size,
+    get_newest_segment_path,
+    store_path,
+)
 
 
 @pytest.mark.parametrize("store", store_fixture)
@@ -230,6 +244,184 @@ def test_get_non_existing_key(store: Store):
     assert store.get(k="some-random-value") is None
 
 
+@pytest.mark.parametrize("store", store_fixture)
+def test_contains(store: Store):
+    """Returns True for existing keys and False for missing, deleted or expired ones"""
+    fill_store(store=store, data=records[:3])
+    fill_store(store=store, data=records[3:5], ttl=1)
+    store.delete(k=records[0][0])
+    time.sleep(2)
+
+    assert store.contains(k=records[0][0]) is False
+    for (k, _) in records[1:3]:
+        assert store.contains(k=k) is True
+    for (k, _) in records[3:]:
+        assert store.contains(k=k) is False
+
+
+@pytest.mark.parametrize("store", store_fixture)
+def test_contains_many(store: Store):
+    """Returns a boolean for each key, in the order given"""
+    fill_store(store=store, data=records[:3])
+    keys = [k for (k, _) in records]
+    assert store.contains_many(keys=keys) == [True] * 3 + [False] * (len(keys) - 3)
+    assert store.contains_many(keys=[]) == []
+
+
+@pytest.mark.parametrize("store", searchable_store_fixture)
+def test_count(store: Store):
+    """Returns the number of key-values whose keys start with the given prefix"""
+    test_data = [
+        ("f", 3),
+        ("fo", 3),
+        ("foo", 2),
+        ("food", 1),
+        ("b", 2),
+        ("bar", 1),
+        ("p", 0),
+        ("pigg", 0),
+        ("bare", 0),
+    ]
+
+    fill_store(store=store, data=search_records)
+    store.delete(k="pig")
+    for (term, expected) in test_data:
+        assert store.count(prefix=term) == expected
+
+
+@pytest.mark.parametrize("store", store_fixture)
+def test_mapping_protocol(store: Store):
+    """store[k], store[k] = v, del store[k] and `k in store` work like get, set, delete and contains"""
+    for (k, v) in records:
+        store[k] = v
+
+    for (k, v) in records:
+        assert k in store
+        assert store[k] == v
+        assert store.get(k=k) == v
+
+    del store[records[0][0]]
+    assert records[0][0] not in store
+    assert store.get(k=records[0][0]) is None
+
+
+@pytest.mark.parametrize("store", store_fixture)
+def test_mapping_protocol_missing_key(store: Store):
+    """store[k] and del store[k] raise KeyError for keys that do not exist"""
+    with pytest.raises(KeyError):
+        _ = store["some-random-key"]
+
+    with pytest.raises(KeyError):
+        del store["some-random-key"]
+
+
+@pytest.mark.parametrize("store", store_fixture)
+def test_mapping_protocol_non_str_value(store: Store):
+    """store[k] = v raises TypeError for values that are not strings with the default codec"""
+    with pytest.raises(TypeError):
+        store["foo"] = {"a": 1}
+
+
+@pytest.mark.parametrize("store", searchable_store_fixture)
+def test_mapping_protocol_keys(store: Store):
+    """len(store) and iterating over the store list every key, including the empty one"""
+    assert len(store) == 0
+    assert list(store) == []
+
+    fill_store(store=store, data=records + [("", "empty")])
+    store.delete(k=records[0][0])
+
+    expected = sorted([k for (k, _) in records[1:]] + [""])
+    assert len(store) == len(expected)
+    assert sorted(store) == expected
+    assert sorted(iter(store)) == expected
+    assert dict(store.search(term="h", skip=0, limit=0)) == {
+        k: store[k] for k in store if k.startswith("h")
+    }
+
+
+@pytest.mark.parametrize("store", store_fixture)
+def test_mapping_protocol_keys_without_search(store: Store):
+    """len(store) and iterating over the store raise TypeError if search is not enabled"""
+    fill_store(store=store, data=records)
+
+    with pytest.raises(TypeError):
+        len(store)
+
+    with pytest.raises(TypeError):
+        iter(store)
+
+
+@pytest.mark.parametrize("store", json_store_fixture)
+def test_json_codec(store: Store):
+    """store[k] = v round-trips dicts, lists, strings, numbers, booleans and None"""
+    test_data = [
+        ("dict", {"a": 1, "b": [1.5, "two", None], "c": {"d": True}}),
+        ("list", [1, -2, 2**63, 0.25, "three", False]),
+        ("str", "English"),
+        ("int", 42),
+        ("float", 3.14),
+        ("bool", True),
+        ("none", None),
+    ]
+
+    for (k, v) in test_data:
+        store[k] = v
+
+    for (k, v) in test_data:
+        assert store[k] == v
+    assert store.get(k="dict") == '{"a":1,"b":[1.5,"two",null],"c":{"d":true}}'
+
+
+@pytest.mark.parametrize("store", json_store_fixture)
+def test_json_codec_tuple(store: Store):
+    """Tuples are saved as JSON arrays and come back as lists"""
+    store["foo"] = (1, "two")
+    assert store["foo"] == [1, "two"]
+
+
+@pytest.mark.parametrize("store", json_store_fixture)
+def test_json_codec_unsupported_values(store: Store):
+    """Values that cannot be saved as JSON raise errors and are not saved"""
+    with pytest.raises(TypeError):
+        store["foo"] = {1, 2}
+
+    with pytest.raises(TypeError):
+        store["foo"] = {1: "non-str key"}
+
+    with pytest.raises(ValueError):
+        store["foo"] = float("nan")
+
+    assert "foo" not in store
+
+
+@pytest.mark.parametrize("store", json_store_fixture)
+def test_json_codec_nesting(store: Store):
+    """Saves lists and dicts nested up to 127 levels, and raises ValueError for deeper or cyclic ones"""
+    deepest = []
+    for _ in range(126):
+        deepest = [deepest]
+    store["deepest"] = deepest
+    assert store["deepest"] == deepest
+
+    with pytest.raises(ValueError):
+        store["too-deep"] = [deepest]
+
+    cyclic = {}
+    cyclic["self"] = cyclic
+    with pytest.raises(ValueError):
+        store["cyclic"] = cyclic
+
+    assert "too-deep" not in store
+    assert "cyclic" not in store
+
+
+def test_invalid_codec():
+    """Raises a ValueError for unknown codecs"""
+    with pytest.raises(ValueError):
+        Store(store_path=store_path, codec="pickle")
+
+
 @pytest.mark.parametrize("store", store_fixture)
 def test_delete_existing_key(store: Store):
     """delete removes the key-value associated with that key"""
@@ -285,3 +477,517 @@ def test_compact(store: Store):
     # the rest are available
     for (k, v) in records[4:]:
         assert store.get(k=k) == v
+
+
+@pytest.mark.parametrize("store", bloom_store_fixture)
+def test_bloom_filter(store: Store):
+    """Short-circuits lookups of keys that were never set, without changing results"""
+    fill_store(store=store, data=records[:3])
+    store.delete(k=records[0][0])
+
+    for (k, v) in records[1:3]:
+        assert store.get(k=k) == v
+        assert store.contains(k=k) is True
+    for (k, _) in records[3:]:
+        assert store.get(k=k) is None
+    assert store.get(k=records[0][0]) is None
+    assert store.contains_many(keys=[k for (k, _) in records[3:]]) == [False] * 4
+
+    stats = store.bloom_filter_stats()
+    assert stats["lookups"] == 14
+    assert 0 < stats["short_circuits"] <= 8
+
+
+@pytest.mark.parametrize("store", bloom_store_fixture)
+def test_bloom_filter_after_clear(store: Store):
+    """Forgets all keys when the store is cleared"""
+    fill_store(store=store, data=records)
+    store.clear()
+    fill_store(store=store, data=records[:1])
+
+    assert store.get(k=records[0][0]) == records[0][1]
+    for (k, _) in records[1:]:
+        assert store.get(k=k) is None
+
+
+def test_bloom_filter_persistence():
+    """Reloads the bloom filter from disk if the store was closed cleanly"""
+    store = Store(store_path=store_path, bloom_filter_fp_rate=0.01)
+    store.clear()
+    fill_store(store=store, data=records[:3])
+    del store
+
+    store = Store(store_path=store_path, bloom_filter_fp_rate=0.01)
+    try:
+        for (k, v) in records[:3]:
+            assert store.get(k=k) == v
+        for (k, _) in records[3:]:
+            assert store.get(k=k) is None
+        assert store.bloom_filter_stats()["short_circuits"] > 0
+    finally:
+        store.clear()
+
+
+def test_bloom_filter_disabled_in_between():
+    """Does not trust the bloom filter if the store was opened without it in between"""
+    store = Store(store_path=store_path, bloom_filter_fp_rate=0.01)
+    del store
+
+    store = Store(store_path=store_path)
+    fill_store(store=store, data=records)
+    assert store.bloom_filter_stats() is None
+    del store
+
+    store = Store(store_path=store_path, bloom_filter_fp_rate=0.01)
+    try:
+        for (k, v) in records:
+            assert store.get(k=k) == v
+        assert store.bloom_filter_stats() == {"lookups": 0, "short_circuits": 0}
+    finally:
+        store.clear()
+
+
+def test_bloom_filter_flush():
+    """Trusts the bloom filter flushed before the process was killed, but not one changed afterwards"""
+    script = (
+        "import os, sys\n"
+        "from py_scdb import Store\n"
+        f"store = Store(store_path={store_path!r}, bloom_filter_fp_rate=0.01)\n"
+        "store.clear()\n"
+        f"for (k, v) in {records[:3]!r}:\n"
+        "    store.set(k=k, v=v)\n"
+        "store.flush()\n"
+        "if sys.argv[1] == 'set':\n"
+        f"    store.set(k={records[3][0]!r}, v={records[3][1]!r})\n"
+        "os._exit(0)\n"
+    )
+
+    for (action, expected_short_circuits) in [("none", 3), ("set", 0)]:
+        subprocess.run([sys.executable, "-c", script, action], check=True)
+        store = Store(store_path=store_path, bloom_filter_fp_rate=0.01)
+        try:
+            for (k, v) in records[:3]:
+                assert store.get(k=k) == v
+            for (k, _) in records[4:]:
+                assert store.get(k=k) is None
+            assert (
+                store.bloom_filter_stats()["short_circuits"] == expected_short_circuits
+            )
+        finally:
+            store.clear()
+            del store
+
+
+def test_bloom_filter_rebuilt_on_compact():
+    """Rebuilds an untrusted bloom filter from the keys in the store when search is enabled"""
+    store = Store(store_path=store_path, is_search_enabled=True)
+    store.clear()
+    fill_store(store=store, data=records[:4])
+    store.delete(k=records[0][0])
+    del store
+
+    store = Store(
+        store_path=store_path, is_search_enabled=True, bloom_filter_fp_rate=0.01
+    )
+    try:
+        assert store.get(k=records[4][0]) is None
+        assert store.bloom_filter_stats()["lookups"] == 0
+
+        store.compact()
+        for (k, v) in records[1:4]:
+            assert store.get(k=k) == v
+        for (k, _) in records[:1] + records[4:]:
+            assert store.get(k=k) is None
+        assert store.bloom_filter_stats()["short_circuits"] > 0
+    finally:
+        store.clear()
+
+
+def test_bloom_filter_rebuilt_with_every_key():
+    """Rebuilds the bloom filter with the empty key and with more keys than are listed at a time"""
+    many_records = [("", "empty")] + [(f"k{i}", f"v{i}") for i in range(2500)]
+    store = Store(store_path=store_path, is_search_enabled=True)
+    store.clear()
+    fill_store(store=store, data=many_records)
+    del store
+
+    store = Store(
+        store_path=store_path, is_search_enabled=True, bloom_filter_fp_rate=0.01
+    )
+    try:
+        store.compact()
+        for (k, v) in many_records:
+            assert store.get(k=k) == v
+        assert store.bloom_filter_stats()["lookups"] == len(many_records)
+    finally:
+        store.clear()
+
+
+def test_bloom_filter_invalid_fp_rate():
+    """Raises an error if the false positive rate is not between 0 and 1"""
+    for rate in [0, 1, 1.5, -0.1]:
+        with pytest.raises(IOError):
+            Store(store_path=store_path, bloom_filter_fp_rate=rate)
+
+
+def test_verify_bloom_filter():
+    """Reports and removes a corrupted bloom filter"""
+    store = Store(store_path=store_path, bloom_filter_fp_rate=0.01)
+    store.clear()
+    fill_store(store=store, data=records)
+    del store
+    assert verify(store_path) == []
+
+    bloom_filter_path = os.path.join(store_path, "bloom.scdb")
+    with open(bloom_filter_path, "r+b") as file:
+        file.seek(30)
+        file.write(b"\xff")
+
+    assert len(verify(store_path)) == 1
+    assert len(verify(store_path, repair=True)) == 1
+    assert not os.path.exists(bloom_filter_path)
+
+    store = Store(store_path=store_path, bloom_filter_fp_rate=0.01)
+    try:
+        for (k, v) in records:
+            assert store.get(k=k) == v
+    finally:
+        store.clear()
+
+
+@pytest.mark.parametrize("store", bloom_store_fixture)
+def test_set_trace_callback(store: Store):
+    """Calls the trace callback with the per-phase timings of each operation"""
+    traces = []
+    store.set_trace_callback(lambda op, timings: traces.append((op, timings)))
+
+    store.set(k="foo", v="bar")
+    store.get(k="foo")
+    store.get(k="some-random-key")
+    store.delete(k="foo")
+
+    assert [op for (op, _) in traces] == ["set", "get", "get", "delete"]
+    assert set(traces[0][1].keys()) == {"lock", "filter", "db", "total"}
+    assert set(traces[1][1].keys()) == {"lock", "filter", "db", "decode", "total"}
+    for (_, timings) in traces:
+        assert timings["total"] >= sum(v for (k, v) in timings.items() if k != "total")
+
+
+@pytest.mark.parametrize("store", store_fixture)
+def test_set_trace_callback_with_sample_rate(store: Store):
+    """Calls the trace callback for only a fraction of the operations"""
+    traces = []
+    store.set_trace_callback(lambda op, _: traces.append(op), sample_rate=0.25)
+
+    for _ in range(20):
+        store.get(k="foo")
+
+    assert traces == ["get"] * 5
+
+
+@pytest.mark.parametrize("store", store_fixture)
+def test_set_trace_callback_none(store: Store):
+    """Stops calling the trace callback when it is set to None"""
+    traces = []
+    store.set_trace_callback(lambda op, _: traces.append(op))
+    store.get(k="foo")
+    store.set_trace_callback(None)
+    store.get(k="foo")
+
+    assert traces == ["get"]
+
+
+@pytest.mark.parametrize("store", store_fixture)
+def test_set_trace_callback_invalid_sample_rate(store: Store):
+    """Raises ValueError if the sample rate is not in (0, 1]"""
+    for rate in [0, -1, 1.5]:
+        with pytest.raises(ValueError):
+            store.set_trace_callback(lambda *_: None, sample_rate=rate)
+
+
+@pytest.mark.parametrize("store", store_fixture)
+def test_concurrent_access_from_threads(store: Store):
+    """Can be used from many threads at once, serializing access to the database file"""
+    data = [(f"key-{i}", f"value-{i}") for i in range(200)]
+
+    def set_and_get(kv):
+        k, v = kv
+        store.set(k=k, v=v)
+        return store.get(k=k)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        got = list(executor.map(set_and_get, data))
+
+    assert got == [v for (_, v) in data]
+    assert store.contains_many(keys=[k for (k, _) in data]) == [True] * len(data)
+
+
+@pytest.mark.parametrize("store", store_fixture)
+def test_set_trace_callback_from_another_thread(store: Store):
+    """The trace callback can be replaced while other threads are using the store"""
+    traces = []
+    data = [(f"key-{i}", f"value-{i}") for i in range(200)]
+
+    def set_and_get(kv):
+        k, v = kv
+        store.set(k=k, v=v)
+        return store.get(k=k)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        future = executor.map(set_and_get, data)
+        for _ in range(20):
+            store.set_trace_callback(lambda op, _: traces.append(op))
+            store.set_trace_callback(None)
+        got = list(future)
+
+    assert got == [v for (_, v) in data]
+    store.set_trace_callback(lambda op, _: traces.append(op))
+    store.get(k="foo")
+    assert traces[-1] == "get"
+
+
+large_records = [(k, v * 100) for (k, v) in records]
+
+
+@pytest.mark.parametrize("store", blob_store_fixture)
+def test_large_values(store: Store):
+    """Stores large values out of line, returning them as usual"""
+    fill_store(store=store, data=large_records)
+    store.set(k="small", v="value")
+
+    for (k, v) in large_records:
+        assert store.get(k=k) == v
+    assert store.get(k="small") == "value"
+    assert store.search(term="h", skip=0, limit=0) == [
+        large_records[0],
+        large_records[1],
+        large_records[4],
+    ]
+    assert get_blobs_size() > sum(len(v) for (_, v) in large_records)
+
+
+@pytest.mark.parametrize("store", blob_store_fixture)
+def test_large_values_with_ttl(store: Store):
+    """Expires large values after their ttl"""
+    ttl = 1
+    fill_store(store=store, data=large_records[:3])
+    fill_store(store=store, data=large_records[3:], ttl=ttl)
+
+    time.sleep(ttl * 2)
+
+    for (k, v) in large_records[:3]:
+        assert store.get(k=k) == v
+    for (k, _) in large_records[3:]:
+        assert store.get(k=k) is None
+
+
+@pytest.mark.parametrize("store", blob_store_fixture)
+def test_compact_large_values(store: Store):
+    """Deletes the files of dead large values, keeping the live ones"""
+    fill_store(store=store, data=large_records)
+    for (k, _) in large_records[1:]:
+        store.delete(k=k)
+    pre_compaction_size = get_blobs_size()
+
+    store.compact()
+
+    assert get_blobs_size() < pre_compaction_size
+    assert store.get(k=large_records[0][0]) == large_records[0][1]
+    for (k, _) in large_records[1:]:
+        assert store.get(k=k) is None
+
+    # all are dead
+    store.delete(k=large_records[0][0])
+    store.compact()
+    assert get_blobs_size() == 0
+
+
+@pytest.mark.parametrize("store", blob_store_fixture)
+def test_compact_overwritten_large_values(store: Store):
+    """Keeps the latest of overwritten large values"""
+    fill_store(store=store, data=large_records)
+    store.compact()
+    updated_records = [(k, v.upper()) for (k, v) in large_records]
+    fill_store(store=store, data=updated_records)
+
+    store.compact()
+
+    for (k, v) in updated_records:
+        assert store.get(k=k) == v
+
+
+@pytest.mark.parametrize("store", blob_store_fixture)
+def test_repeated_compaction_of_large_values(store: Store):
+    """Does not add segment files when the large values are mostly live"""
+    fill_store(store=store, data=large_records)
+    store.compact()
+    segments = os.listdir(os.path.join(store_path, "blobs"))
+
+    for (k, v) in large_records[:2]:
+        store.set(k=k, v=v.upper())
+        store.compact()
+
+    assert os.listdir(os.path.join(store_path, "blobs")) == segments
+    assert store.get(k=large_records[0][0]) == large_records[0][1].upper()
+
+
+def test_large_values_after_crash():
+    """Drops a zero-filled tail of the newest segment file when the store is reopened"""
+    store = Store(store_path=store_path, blob_threshold=64)
+    store.clear()
+    fill_store(store=store, data=large_records)
+    del store
+
+    blobs_size = get_blobs_size()
+    with open(get_newest_segment_path(), "ab") as file:
+        file.write(b"\0" * 100)
+
+    store = Store(store_path=store_path, blob_threshold=64)
+    try:
+        assert get_blobs_size() == blobs_size
+        for (k, v) in large_records:
+            assert store.get(k=k) == v
+    finally:
+        store.clear()
+
+
+def test_large_values_after_garbage_header():
+    """Drops a tail whose header claims a record too large to fit, when the store is reopened"""
+    store = Store(store_path=store_path, blob_threshold=64)
+    store.clear()
+    fill_store(store=store, data=large_records)
+    del store
+
+    blobs_size = get_blobs_size()
+    with open(get_newest_segment_path(), "ab") as file:
+        # the value size makes the end of the record overflow
+        file.write(struct.pack(">IQ", 1, 2**64 - 16) + b"\0" * 12)
+
+    assert len(verify(store_path)) == 1
+    store = Store(store_path=store_path, blob_threshold=64)
+    try:
+        assert get_blobs_size() == blobs_size
+        for (k, v) in large_records:
+            assert store.get(k=k) == v
+    finally:
+        store.clear()
+
+
+def test_large_values_from_two_stores():
+    """Keeps apart the large values set by two stores open on the same path"""
+    store = Store(store_path=store_path, blob_threshold=64)
+    store.clear()
+    other_store = Store(store_path=store_path, blob_threshold=64)
+    try:
+        for (i, (k, v)) in enumerate(large_records):
+            (store if i % 2 == 0 else other_store).set(k=k, v=v)
+        for (i, (k, v)) in enumerate(large_records):
+            assert (store if i % 2 == 0 else other_store).get(k=k) == v
+    finally:
+        del other_store
+        store.clear()
+
+
+def test_corrupted_large_value():
+    """Reads a large value whose checksum does not match as absent"""
+    store = Store(store_path=store_path, blob_threshold=64)
+    store.clear()
+    fill_store(store=store, data=large_records)
+    del store
+
+    with open(get_newest_segment_path(), "r+b") as file:
+        file.seek(-1, os.SEEK_END)
+        file.write(b"?")
+
+    store = Store(store_path=store_path, blob_threshold=64)
+    try:
+        for (k, v) in large_records[:-1]:
+            assert store.get(k=k) == v
+        assert store.get(k=large_records[-1][0]) is None
+    finally:
+        store.clear()
+
+
+def test_verify():
+    """Reports and repairs corrupted segment files of large values"""
+    store = Store(store_path=store_path, blob_threshold=64)
+    store.clear()
+    fill_store(store=store, data=large_records)
+    del store
+    assert verify(store_path) == []
+
+    with open(get_newest_segment_path(), "r+b") as file:
+        file.seek(-1, os.SEEK_END)
+        file.write(b"?")
+    blobs_size = get_blobs_size()
+
+    assert len(verify(store_path)) == 1
+    assert get_blobs_size() == blobs_size
+    assert len(verify(store_path, repair=True)) == 1
+    assert get_blobs_size() < blobs_size
+    assert verify(store_path) == []
+
+    store = Store(store_path=store_path, blob_threshold=64)
+    try:
+        for (k, v) in large_records[:-1]:
+            assert store.get(k=k) == v
+        assert store.get(k=large_records[-1][0]) is None
+    finally:
+        store.clear()
+
+
+def test_verify_corrupted_record_before_intact_ones():
+    """Drops only the corrupted record when intact ones follow it in the segment"""
+    store = Store(store_path=store_path, blob_threshold=64, is_search_enabled=True)
+    store.clear()
+    fill_store(store=store, data=large_records)
+    del store
+
+    # the first byte of the value of the second record
+    (first_key, first_value), (key, _) = large_records[:2]
+    offset = 24 + len(first_key) + len(first_value) + 24 + len(key)
+    with open(get_newest_segment_path(), "r+b") as file:
+        file.seek(offset)
+        file.write(b"?")
+    blobs_size = get_blobs_size()
+
+    assert len(verify(store_path, repair=True)) == 1
+    assert get_blobs_size() == blobs_size
+    assert verify(store_path) == []
+
+    store = Store(store_path=store_path, blob_threshold=64, is_search_enabled=True)
+    try:
+        for (k, v) in large_records:
+            assert store.get(k=k) == (None if k == key else v)
+        assert store.search(term="h", skip=0, limit=0) == [
+            large_records[0],
+            large_records[4],
+        ]
+    finally:
+        store.clear()
+
+
+def test_verify_open_store():
+    """Refuses to repair a store that is open"""
+    store = Store(store_path=store_path, blob_threshold=64)
+    try:
+        assert verify(store_path) == []
+        with pytest.raises(IOError):
+            verify(store_path, repair=True)
+    finally:
+        store.clear()
+
+
+def test_large_values_without_blob_threshold():
+    """Reads large values stored out of line even if the store is reopened without blob_threshold"""
+    store = Store(store_path=store_path, blob_threshold=64)
+    store.clear()
+    fill_store(store=store, data=large_records)
+    del store
+
+    store = Store(store_path=store_path)
+    try:
+        for (k, v) in large_records:
+            assert store.get(k=k) == v
+    finally:
+        store.clear()
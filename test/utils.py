@@ -33,3 +33,18 @@ def get_async_db_file_size() -> int:
     """Returns the size of the database file"""
     db_file_path = os.path.join(async_store_path, "dump.scdb")
     return os.stat(db_file_path).st_size
+
+
+def get_newest_segment_path() -> str:
+    """Returns the path to the segment file that large values are being appended to"""
+    blobs_path = os.path.join(store_path, "blobs")
+    return os.path.join(blobs_path, max(os.listdir(blobs_path)))
+
+
+def get_blobs_size() -> int:
+    """Returns the total size of the files holding the large values"""
+    blobs_path = os.path.join(store_path, "blobs")
+    return sum(
+        os.stat(os.path.join(blobs_path, name)).st_size
+        for name in os.listdir(blobs_path)
+    )